@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+
+from flowerapp.caching import LocalVersionedValue
+from flowerapp.models import Order
+
+User = get_user_model()
+
+# statuses of orders which are open work of florist
+FLORIST_OPEN_STATUSES = [Order.Status.created, Order.Status.composing]
+# workload is rebuilt from database with this period, so changes of other processes and admin are caught up
+FLORISTS_WORKLOAD_TTL = 60
+
+
+class FloristsWorkload:
+    """Counts of open orders of active florists with priority queue of florists by count
+
+    Florist with the least count is on top of heap, so assignment of order doesn't scan orders or florists.
+    Changed count is pushed to heap as new entry and old entries are dropped when they reach top (lazy deletion).
+    Counts are changed after commit of orders (see floristapp.signals), so orders which are not committed
+    are not counted. Workload is shared between threads and changed in place, so it has its own lock.
+    """
+
+    def __init__(self, counts: dict[int, int]):
+        self.counts = dict(counts)
+        self._lock = threading.Lock()
+        self._heap = []
+        self._compact()
+
+    @classmethod
+    def build(cls) -> 'FloristsWorkload':
+        florists_ids = User.objects.filter(role=User.Role.florist, is_active=True).values_list('id', flat=True)
+        counts = dict.fromkeys(florists_ids, 0)
+        open_orders_counts = Order.objects.filter(
+            status__in=FLORIST_OPEN_STATUSES,
+            florist__isnull=False
+        ).values_list('florist').annotate(orders_count=Count('id')).order_by()
+        for florist_id, orders_count in open_orders_counts:
+            if florist_id in counts:
+                counts[florist_id] = orders_count
+        return cls(counts)
+
+    def _compact(self) -> None:
+        # florists with equal counts are ordered by id
+        self._heap = [(count, florist_id) for florist_id, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _change(self, florist_id: int, delta: int) -> None:
+        self.counts[florist_id] = max(self.counts[florist_id] + delta, 0)
+        heapq.heappush(self._heap, (self.counts[florist_id], florist_id))
+        if len(self._heap) > 2 * len(self.counts) + 16:
+            self._compact()
+
+    def change(self, florist_id: int, delta: int) -> None:
+        """Change count of open orders of florist, unknown florists (not florists or inactive) are ignored"""
+        with self._lock:
+            if florist_id in self.counts:
+                self._change(florist_id, delta)
+
+    def pick(self) -> Optional[int]:
+        """Get id of florist with the least count of open orders, None without florists, count is not changed"""
+        with self._lock:
+            while self._heap:
+                count, florist_id = self._heap[0]
+                if self.counts[florist_id] == count:
+                    return florist_id
+                heapq.heappop(self._heap)
+            return None
+
+
+_invalidations = itertools.count()
+_invalidation = next(_invalidations)
+
+
+def invalidate_florists_workload() -> None:
+    """Rebuild workload on next use, for changes of florists and orders which are not tracked by counts"""
+    global _invalidation
+    _invalidation = next(_invalidations)
+
+
+_florists_workload = LocalVersionedValue(
+    FloristsWorkload.build,
+    lambda: (_invalidation, int(time.monotonic() // FLORISTS_WORKLOAD_TTL))
+)
+
+
+def get_florists_workload() -> FloristsWorkload:
+    return _florists_workload.get()
+
+
+def get_current_florists_workload() -> Optional[FloristsWorkload]:
+    """Get workload if it is not needed to rebuild it, None otherwise, database is not queried"""
+    return _florists_workload.get_current()
@@ -0,0 +1,131 @@
+import hashlib
+import math
+from itertools import groupby
+from typing import Any
+
+from flowerapp.models import Order
+
+# max count of orders which courier delivers by one trip
+COURIER_BATCH_SIZE = 8
+# orders don't have coordinates yet, so synthetic coordinates are in square with shop in center
+DELIVERY_RADIUS_KM = 15
+# coordinates of shop, all routes start from it
+DEPOT_POINT = (0.0, 0.0)
+
+Point = tuple[float, float]
+
+
+def get_address_point(address: str) -> Point:
+    """Get synthetic coordinates of address in km from shop, they are stable for address until geocoding is added"""
+    digest = hashlib.md5(address.encode()).digest()
+    x, y = int.from_bytes(digest[:4], 'big'), int.from_bytes(digest[4:8], 'big')
+    return (
+        (x / 0xFFFFFFFF * 2 - 1) * DELIVERY_RADIUS_KM,
+        (y / 0xFFFFFFFF * 2 - 1) * DELIVERY_RADIUS_KM,
+    )
+
+
+def get_distance(first_point: Point, second_point: Point) -> float:
+    return math.hypot(first_point[0] - second_point[0], first_point[1] - second_point[1])
+
+
+def get_route_length(points: list[Point], route: list[int]) -> float:
+    """Get length of route from shop through points with indexes in route, courier doesn't return to shop"""
+    route_points = [DEPOT_POINT] + [points[index] for index in route]
+    return sum(get_distance(start, end) for start, end in zip(route_points, route_points[1:]))
+
+
+def get_nearest_neighbour_route(points: list[Point], indexes: list[int]) -> list[int]:
+    """Get route through points with indexes by going from shop to the nearest not visited point (greedy)"""
+    route = []
+    current_point = DEPOT_POINT
+    not_visited = set(indexes)
+    while not_visited:
+        # ties are broken by index, so route doesn't depend on order of set
+        nearest = min(not_visited, key=lambda index: (get_distance(current_point, points[index]), index))
+        route.append(nearest)
+        not_visited.remove(nearest)
+        current_point = points[nearest]
+    return route
+
+
+def improve_route(points: list[Point], route: list[int]) -> list[int]:
+    """Improve route by 2-opt: reverse parts of route while it makes route shorter"""
+    route_points = [DEPOT_POINT] + [points[index] for index in route]
+    route = [None] + route  # shop is the first point of route and it is not moved
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(route) - 1):
+            for j in range(i + 1, len(route)):
+                # edges (i - 1, i) and (j, j + 1) are replaced by (i - 1, j) and (i, j + 1), last point has no next
+                before = get_distance(route_points[i - 1], route_points[i])
+                after = get_distance(route_points[i - 1], route_points[j])
+                if j + 1 < len(route):
+                    before += get_distance(route_points[j], route_points[j + 1])
+                    after += get_distance(route_points[i], route_points[j + 1])
+                if after < before - 1e-9:
+                    route[i:j + 1] = reversed(route[i:j + 1])
+                    route_points[i:j + 1] = reversed(route_points[i:j + 1])
+                    improved = True
+    return route[1:]
+
+
+def split_by_sweep(points: list[Point], batch_size: int) -> list[list[int]]:
+    """Split points to batches of neighbour points by sweep of ray from shop
+
+    Points are sorted by angle around shop and cut to batches of batch_size, so batch is a sector of area.
+    Sweep starts after the widest gap between angles of points, so it doesn't cut group of close points.
+    """
+    if not points:
+        return []
+    angles = [math.atan2(y - DEPOT_POINT[1], x - DEPOT_POINT[0]) for x, y in points]
+    indexes = sorted(range(len(points)), key=lambda index: (angles[index], index))
+    gaps = [
+        (angles[indexes[position]] - angles[indexes[position - 1]]) % (2 * math.pi)
+        for position in range(len(indexes))
+    ]
+    start = max(range(len(indexes)), key=lambda position: gaps[position]) if len(indexes) > 1 else 0
+    indexes = indexes[start:] + indexes[:start]
+    return [indexes[position:position + batch_size] for position in range(0, len(indexes), batch_size)]
+
+
+def plan_routes(points: list[Point], batch_size: int = COURIER_BATCH_SIZE) -> list[list[int]]:
+    """Split points to batches and find short route of every batch, return routes of indexes of points
+
+    Cost is O(n log n) for sweep and O(batch_size ** 3) for routes of batches, so hundreds of orders
+    are planned in milliseconds.
+    """
+    return [
+        improve_route(points, get_nearest_neighbour_route(points, batch))
+        for batch in split_by_sweep(points, batch_size)
+    ]
+
+
+def propose_delivery_batches(orders: list[Order], batch_size: int = COURIER_BATCH_SIZE) -> list[dict[str, Any]]:
+    """Group orders by delivery window and propose batches of orders for couriers with routes
+
+    Orders without window (as soon as possible) are the first group. Return groups with window and
+    batches, batch is orders in order of delivery and length of route in km.
+    """
+    def get_window_key(order: Order) -> tuple[bool, int, int]:
+        window = order.delivery_window
+        if window is None:
+            return False, 0, 0
+        return True, window.from_hour or 0, window.id
+
+    groups = []
+    for _, window_orders in groupby(sorted(orders, key=get_window_key), key=get_window_key):
+        window_orders = list(window_orders)
+        points = [get_address_point(order.delivery_address) for order in window_orders]
+        groups.append({
+            'window': window_orders[0].delivery_window,
+            'batches': [
+                {
+                    'orders': [window_orders[index] for index in route],
+                    'distance_km': get_route_length(points, route),
+                }
+                for route in plan_routes(points, batch_size)
+            ],
+        })
+    return groups
@@ -0,0 +1,78 @@
+import asyncio
+import collections
+import threading
+import uuid
+from typing import Any, Optional
+
+ORDERS_HUB_SIZE = 1000
+
+
+class OrdersHub:
+    """Broadcast of events of orders to requests which wait for them in this process
+
+    Events are kept in buffer of last ORDERS_HUB_SIZE events with increasing ids, so every waiting request reads
+    events after its id without database. Events are published from threads of sync code and are awaited
+    in event loops of async views. Every process has its own hub with its own id, so cursor from other process
+    or too old cursor is reported as lost and client should reload queue.
+    """
+
+    def __init__(self, size: int = ORDERS_HUB_SIZE):
+        self.id = uuid.uuid4().hex[:8]
+        self._lock = threading.RLock()
+        self._events = collections.deque(maxlen=size)
+        self._last_event_id = 0
+        self._waiters = set()
+
+    @property
+    def cursor(self) -> str:
+        """Cursor of last published event"""
+        return f'{self.id}_{self._last_event_id}'
+
+    def publish(self, event: dict[str, Any]) -> None:
+        with self._lock:
+            self._last_event_id += 1
+            self._events.append((self._last_event_id, event))
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._wake, future)
+
+    @staticmethod
+    def _wake(future: asyncio.Future) -> None:
+        # future is cancelled if waiting is timed out
+        if not future.done():
+            future.set_result(None)
+
+    def get_events(self, cursor: Optional[str]) -> Optional[list[dict[str, Any]]]:
+        """Get events published after cursor, None if cursor is not of this hub or some events are not kept"""
+        hub_id, _, event_id = (cursor or '').partition('_')
+        if hub_id != self.id or not event_id.isdigit():
+            return None
+        event_id = int(event_id)
+        with self._lock:
+            if event_id > self._last_event_id:
+                return None
+            first_event_id = self._events[0][0] if self._events else self._last_event_id + 1
+            if event_id < first_event_id - 1:
+                return None
+            return [event for kept_event_id, event in self._events if kept_event_id > event_id]
+
+    async def wait_events(self, cursor: Optional[str], timeout: float) -> tuple[Optional[list[dict[str, Any]]], str]:
+        """Wait for events after cursor not longer than timeout, return events (see get_events) and new cursor"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            # under lock, so event can't be published between reading of events and registration of waiter
+            events, new_cursor = self.get_events(cursor), self.cursor
+            if events != []:
+                return events, new_cursor
+            self._waiters.add((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._waiters.discard((loop, future))
+        with self._lock:
+            return self.get_events(cursor), self.cursor
+
+
+orders_hub = OrdersHub()
@@ -0,0 +1,54 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from flowerapp.models import DeliveryWindow
+from flowerapp.models import Order
+from floristapp.dispatch import COURIER_BATCH_SIZE, get_address_point, get_route_length, propose_delivery_batches
+
+
+class Command(BaseCommand):
+    help = "Benchmark planning of delivery batches on generated orders, database is not used"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=300, help='count of orders in every window')
+        parser.add_argument('--windows', type=int, default=3, help='count of delivery windows')
+        parser.add_argument('--batch-size', type=int, default=COURIER_BATCH_SIZE, help='max orders of courier trip')
+        parser.add_argument('--repeat', type=int, default=5, help='count of runs')
+        parser.add_argument('--seed', type=int, default=0, help='seed of generated addresses')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        windows = [
+            DeliveryWindow(id=number + 1, name=f'с {10 + number * 2} до {12 + number * 2}',
+                           from_hour=10 + number * 2, to_hour=12 + number * 2)
+            for number in range(options['windows'])
+        ]
+        orders = [
+            Order(id=number + 1, delivery_address=f'адрес {random.getrandbits(64)}', delivery_window=window)
+            for number, window in enumerate(window for window in windows for _ in range(options['orders']))
+        ]
+        print(f'{len(orders)} orders in {len(windows)} windows, batch size {options["batch_size"]}')
+
+        durations = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            windows_batches = propose_delivery_batches(orders, options['batch_size'])
+            durations.append(time.perf_counter() - start)
+        print(f'planning time: median {statistics.median(durations) * 1000:.1f} ms, '
+              f'max {max(durations) * 1000:.1f} ms')
+
+        batches = [batch for window_batches in windows_batches for batch in window_batches['batches']]
+        planned_distance = sum(batch['distance_km'] for batch in batches)
+        # baseline is batches of orders in order of creation
+        points = [get_address_point(order.delivery_address) for order in orders]
+        baseline_distance = sum(
+            get_route_length(points, list(range(start, min(start + options['batch_size'], window_end))))
+            for window_start in range(0, len(orders), options['orders'])
+            for window_end in [window_start + options['orders']]
+            for start in range(window_start, window_end, options['batch_size'])
+        )
+        print(f'{len(batches)} batches, {planned_distance:.0f} km of routes, '
+              f'{baseline_distance:.0f} km for batches in order of creation')
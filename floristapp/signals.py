@@ -0,0 +1,81 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from flowerapp.models import Order
+from flowerapp.models import order_status_changed
+
+from .assignment import FLORIST_OPEN_STATUSES
+from .assignment import get_current_florists_workload
+from .assignment import get_florists_workload
+from .assignment import invalidate_florists_workload
+from .hub import orders_hub
+
+User = get_user_model()
+
+
+def publish_order_event(event_type: str, order_id: int) -> None:
+    # order is loaded once for all waiting screens, they render it without database
+    order = Order.objects.select_related('bouquet', 'delivery_window', 'florist').filter(id=order_id).first()
+    if order:
+        orders_hub.publish({'type': event_type, 'order': order})
+
+
+@receiver(post_save, sender=Order)
+def publish_created_order(sender, instance: Order, created: bool, **kwargs):
+    if created:
+        order_id = instance.id
+        transaction.on_commit(lambda: publish_order_event('created', order_id))
+
+
+@receiver(order_status_changed, sender=Order)
+def publish_changed_order_status(sender, order: Order, **kwargs):
+    transaction.on_commit(lambda: publish_order_event('status_changed', order.id))
+
+
+@receiver(pre_save, sender=Order)
+def assign_florist(sender, instance: Order, **kwargs):
+    if not instance._state.adding or instance.florist_id is not None or instance.status not in FLORIST_OPEN_STATUSES:
+        return
+    # florist is set before insert, so assignment is in the same write as order. Workload is not rebuilt here,
+    # because in SQLite read before insert in transaction can fail insert if other order is committed meanwhile
+    workload = get_current_florists_workload()
+    if workload:
+        instance.florist_id = workload.pick()
+    else:
+        instance._florist_assignment_postponed = True
+
+
+@receiver(post_save, sender=Order)
+def count_assigned_florist(sender, instance: Order, created: bool, **kwargs):
+    if not created:
+        return
+    if getattr(instance, '_florist_assignment_postponed', False):
+        # workload is rebuilt after insert, when transaction already writes
+        instance._florist_assignment_postponed = False
+        instance.florist_id = get_florists_workload().pick()
+        if instance.florist_id:
+            Order.objects.filter(id=instance.id).update(florist_id=instance.florist_id)
+    if instance.florist_id and instance.status in FLORIST_OPEN_STATUSES:
+        # after commit, so orders which are not created (for example repeated submits of form) are not counted
+        florist_id = instance.florist_id
+        transaction.on_commit(lambda: get_florists_workload().change(florist_id, 1))
+
+
+@receiver(order_status_changed, sender=Order)
+def release_florist(sender, order: Order, old_status: str, **kwargs):
+    if old_status in FLORIST_OPEN_STATUSES and order.status not in FLORIST_OPEN_STATUSES and order.florist_id:
+        florist_id = order.florist_id
+        transaction.on_commit(lambda: get_florists_workload().change(florist_id, -1))
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_workload(sender, instance, created: bool = False, **kwargs):
+    # new orders are counted on assignment, other changes of orders (for example in admin) and florists
+    # are not tracked by counts, so workload is rebuilt
+    if not (sender is Order and created):
+        invalidate_florists_workload()
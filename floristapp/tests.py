@@ -1,3 +1,319 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from flowerapp.models import Bouquet, DeliveryWindow, Order, OrderDailySketch, OrderRollup
+
+from .assignment import FloristsWorkload, get_florists_workload, invalidate_florists_workload
+from .dispatch import COURIER_BATCH_SIZE, get_address_point, get_route_length, propose_delivery_batches
+from .hub import OrdersHub
+from .views import FLORIST_ORDER_STATUSES
+
+User = get_user_model()
+
+
+class FloristOrdersQueueTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                         height_cm=30, width_cm=20)
+        statuses = [Order.Status.composed, Order.Status.created, Order.Status.delivered, Order.Status.composing]
+        created_at = timezone.now() - datetime.timedelta(hours=1)
+        for i in range(40):
+            Order.objects.create(
+                bouquet=bouquet,
+                price=bouquet.price,
+                client_name='клиент',
+                phone='+79000000000',
+                delivery_address='адрес',
+                paid=True,
+                status=statuses[i % len(statuses)],
+                # orders with equal time of creation are ordered by id
+                created_at=created_at - datetime.timedelta(minutes=i // 8),
+            )
+        cls.florist = User.objects.create_user(username='florist', password='password', role=User.Role.florist)
+
+    @mock.patch('floristapp.views.ORDERS_PAGE_SIZE', 7)
+    def test_pages_cover_queue_in_order(self):
+        self.client.force_login(self.florist)
+        response = self.client.get(reverse('floristapp:orders'))
+        orders = list(response.context['orders'])
+        cursor = response.context['next_cursor']
+        self.assertIsNotNone(cursor)
+        while cursor:
+            response = self.client.get(reverse('floristapp:orders'), {'after': cursor})
+            orders += response.context['orders']
+            cursor = response.context['next_cursor']
+
+        expected_orders = sorted(
+            Order.objects.filter(status__in=FLORIST_ORDER_STATUSES),
+            key=lambda order: (FLORIST_ORDER_STATUSES.index(order.status), order.created_at, order.id)
+        )
+        self.assertEqual(orders, expected_orders)
+
+    def test_page_is_bounded(self):
+        orders, cursor = Order.objects.get_queue_page(FLORIST_ORDER_STATUSES, None, 7)
+        self.assertEqual(len(orders), 7)
+        orders, _ = Order.objects.get_queue_page(FLORIST_ORDER_STATUSES, cursor, 100)
+        self.assertEqual(len(orders), 30 - 7)
+
+    def test_invalid_cursor_returns_first_page(self):
+        self.client.force_login(self.florist)
+        first_page = list(self.client.get(reverse('floristapp:orders')).context['orders'])
+        for cursor in ['unknown', '0_99999999999999999999_1', '0_-99999999999999999999_1']:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('floristapp:orders'), {'after': cursor})
+                self.assertEqual(list(response.context['orders']), first_page)
+
+
+class OrderTransitionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                         height_cm=30, width_cm=20)
+        cls.order = Order.objects.create(bouquet=bouquet, price=bouquet.price, client_name='клиент',
+                                         phone='+79000000000', delivery_address='адрес', paid=True)
+        cls.florist = User.objects.create_user(username='florist', password='password', role=User.Role.florist)
+
+    def get_rollups(self):
+        return list(OrderRollup.objects.values_list('day', 'hour', 'orders_count', 'order_to_compose_count'))
+
+    def test_transition_is_done_once(self):
+        self.assertIsNotNone(Order.objects.transition(self.order.id, Order.Status.created))
+        self.assertIsNone(Order.objects.transition(self.order.id, Order.Status.created))
+
+        order = Order.objects.transition(self.order.id, Order.Status.composing)
+        self.assertEqual(order.status, Order.Status.composed)
+        self.assertIsNotNone(order.composed_at)
+        self.assertIsNone(order.delivered_at)
+
+        rollups = self.get_rollups()
+        OrderRollup.objects.rebuild()
+        self.assertEqual(rollups, self.get_rollups())
+        self.assertEqual(rollups[0][3], 1)
+
+    def test_transitions_apply_deltas_of_rollups(self):
+        order = Order.objects.create(bouquet=self.order.bouquet, price=self.order.price, client_name='клиент',
+                                     phone='+79000000001', delivery_address='адрес', paid=True,
+                                     created_at=timezone.now() - datetime.timedelta(days=1, hours=1))
+        with mock.patch.object(OrderRollup.objects, 'rebuild') as rebuild:
+            for status in [Order.Status.created, Order.Status.composing, Order.Status.composed,
+                           Order.Status.delivering]:
+                Order.objects.transition(order.id, status)
+                self.assertEqual(OrderRollup.objects.get_mismatched_days(), [])
+                self.assertEqual(OrderDailySketch.objects.get_mismatched_days(), [])
+        rebuild.assert_not_called()
+        self.assertEqual(OrderRollup.objects.aggregate(Sum('order_to_delivery_count'))['order_to_delivery_count__sum'],
+                         1)
+
+    def test_change_status_returns_row_of_order(self):
+        self.client.force_login(self.florist)
+        url = reverse('floristapp:change_status', args=[self.order.id])
+        response = self.client.post(url, {'status': Order.Status.created})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Order.Status.composing)
+        self.assertIn(f'id="order-{self.order.id}"', response.json()['html'])
+        self.assertEqual(Order.objects.get(id=self.order.id).florist, self.florist)
+
+        # second click on the same button
+        response = self.client.post(url, {'status': Order.Status.created})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['status'], Order.Status.composing)
+
+        response = self.client.post(url, {'status': Order.Status.composed})
+        self.assertEqual(response.status_code, 400)
+
+
+class OrdersHubTest(TestCase):
+    def test_events_after_cursor(self):
+        hub = OrdersHub(size=2)
+        cursor = hub.cursor
+        self.assertEqual(asyncio.run(hub.wait_events(cursor, timeout=0.01)), ([], cursor))
+
+        async def wait_published_event():
+            waiting = asyncio.ensure_future(hub.wait_events(cursor, timeout=5))
+            await asyncio.sleep(0)
+            hub.publish({'type': 'created'})
+            return await waiting
+
+        events, new_cursor = asyncio.run(wait_published_event())
+        self.assertEqual(events, [{'type': 'created'}])
+        self.assertEqual(hub.get_events(new_cursor), [])
+
+        # events after cursor are dropped from buffer, cursor of other process is unknown
+        hub.publish({'type': 'status_changed'})
+        hub.publish({'type': 'status_changed'})
+        self.assertIsNone(hub.get_events(cursor))
+        self.assertIsNone(OrdersHub().get_events(new_cursor))
+
+
+class OrderEventsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                             height_cm=30, width_cm=20)
+        cls.florist = User.objects.create_user(username='florist', password='password', role=User.Role.florist)
+
+    def test_screen_receives_created_and_changed_orders(self):
+        self.client.force_login(self.florist)
+        cursor = self.client.get(reverse('floristapp:orders')).context['events_cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(bouquet=self.bouquet, price=self.bouquet.price, client_name='клиент',
+                                         phone='+79000000000', delivery_address='адрес', paid=True)
+
+        data = self.client.get(reverse('floristapp:order_events'), {'after': cursor}).json()
+        self.assertFalse(data['reset'])
+        self.assertEqual([change['id'] for change in data['orders']], [order.id])
+        self.assertIn(f'id="order-{order.id}"', data['orders'][0]['html'])
+
+        for status in [Order.Status.created, Order.Status.composing, Order.Status.composed]:
+            with self.captureOnCommitCallbacks(execute=True):
+                Order.objects.transition(order.id, status)
+        data = self.client.get(reverse('floristapp:order_events'), {'after': data['cursor']}).json()
+        # order is delivering, so it left queue of florists
+        self.assertEqual(data['orders'], [{'id': order.id, 'status': Order.Status.delivering, 'html': ''}])
+
+        self.assertTrue(self.client.get(reverse('floristapp:order_events'), {'after': 'unknown'}).json()['reset'])
+
+
+class DeliveryDispatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                         height_cm=30, width_cm=20)
+        windows = [
+            DeliveryWindow.objects.create(name='с 10 до 12', from_hour=10, to_hour=12),
+            DeliveryWindow.objects.create(name='с 12 до 14', from_hour=12, to_hour=14),
+            None,
+        ]
+        for i in range(60):
+            Order.objects.create(bouquet=bouquet, price=bouquet.price, client_name='клиент', phone='+79000000000',
+                                 delivery_address=f'адрес {i}', delivery_window=windows[i % 3], paid=True,
+                                 status=Order.Status.composed if i < 50 else Order.Status.delivering)
+        cls.courier = User.objects.create_user(username='courier', password='password', role=User.Role.courier)
+
+    def test_batches_cover_orders_of_windows(self):
+        orders = list(Order.objects.filter(status=Order.Status.composed).select_related('delivery_window'))
+        windows_batches = propose_delivery_batches(orders)
+
+        self.assertEqual([window_batches['window'] and window_batches['window'].name
+                          for window_batches in windows_batches], [None, 'с 10 до 12', 'с 12 до 14'])
+        batched_orders = []
+        for window_batches in windows_batches:
+            for batch in window_batches['batches']:
+                self.assertLessEqual(len(batch['orders']), COURIER_BATCH_SIZE)
+                self.assertTrue(all(order.delivery_window == window_batches['window'] for order in batch['orders']))
+                points = [get_address_point(order.delivery_address) for order in batch['orders']]
+                self.assertAlmostEqual(batch['distance_km'], get_route_length(points, list(range(len(points)))))
+                batched_orders += batch['orders']
+        self.assertCountEqual(batched_orders, orders)
+
+    def test_courier_takes_order_from_dispatch(self):
+        self.client.force_login(self.courier)
+        response = self.client.get(reverse('floristapp:dispatch'))
+        self.assertEqual(len(response.context['delivering_orders']), 10)
+        order = response.context['windows_batches'][0]['batches'][0]['orders'][0]
+        self.assertContains(response, 'Взять в доставку')
+
+        response = self.client.post(reverse('floristapp:change_status', args=[order.id]),
+                                    {'status': Order.Status.composed})
+        self.assertEqual(response.json()['status'], Order.Status.delivering)
+        self.assertIn('Доставлен', response.json()['html'])
+        self.assertEqual(Order.objects.get(id=order.id).courier, self.courier)
+
+
+@override_settings(LINK_PAY='http://pay/?amount=')
+class FloristAssignmentTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                             height_cm=30, width_cm=20)
+        cls.window = DeliveryWindow.objects.create(name='утро', from_hour=9, to_hour=12)
+        cls.florists = [
+            User.objects.create_user(username=f'florist_{i}', password='password', role=User.Role.florist)
+            for i in range(3)
+        ]
+        User.objects.create_user(username='fired', password='password', role=User.Role.florist, is_active=False)
+        for status in [Order.Status.created, Order.Status.composing, Order.Status.delivered]:
+            cls.create_order(florist=cls.florists[0], status=status)
+
+    def setUp(self):
+        # orders and florists of tests are deleted by rollback, it doesn't send signals
+        invalidate_florists_workload()
+        self.addCleanup(invalidate_florists_workload)
+        cache.clear()
+
+    @classmethod
+    def create_order(cls, **fields):
+        return Order.objects.create(bouquet=cls.bouquet, price=cls.bouquet.price, client_name='клиент',
+                                    phone='+79000000000', delivery_address='адрес', paid=True, **fields)
+
+    def get_counts(self):
+        return [get_florists_workload().counts[florist.id] for florist in self.florists]
+
+    def test_workload_picks_least_loaded_florist(self):
+        workload = FloristsWorkload({1: 2, 2: 0, 3: 1})
+        picked_florists = []
+        for _ in range(4):
+            picked_florists.append(workload.pick())
+            workload.change(picked_florists[-1], 1)
+        self.assertEqual(picked_florists, [2, 2, 3, 1])
+        workload.change(1, -2)
+        workload.change(4, 1)  # not florist
+        self.assertEqual(workload.pick(), 1)
+        self.assertEqual(workload.counts, {1: 1, 2: 2, 3: 2})
+        self.assertIsNone(FloristsWorkload({}).pick())
+
+    def test_new_orders_are_balanced_between_florists(self):
+        get_florists_workload()
+        with self.assertNumQueries(0):
+            get_florists_workload().pick()  # workload is kept in memory
+        invalidate_florists_workload()
+
+        orders = []
+        for _ in range(5):
+            with self.captureOnCommitCallbacks(execute=True):
+                orders.append(self.create_order())
+        # the first florist has 2 open orders
+        self.assertEqual([order.florist for order in orders], [self.florists[i] for i in [1, 2, 1, 2, 0]])
+        self.assertEqual([order.florist for order in Order.objects.filter(id__in=[order.id for order in orders])],
+                         [order.florist for order in orders])
+
+        # composed order is not work of florist anymore
+        for status in [Order.Status.created, Order.Status.composing]:
+            with self.captureOnCommitCallbacks(execute=True):
+                Order.objects.transition(orders[0].id, status)
+        self.assertEqual(self.get_counts(), [3, 1, 2])
+        self.assertEqual(self.create_order().florist, self.florists[1])
+
+    def test_repeated_submits_are_counted_once(self):
+        self.assertEqual(self.get_counts(), [2, 0, 0])
+        url = reverse('order', args=[self.bouquet.id])
+        data = {
+            'idempotency_key': uuid.uuid4(),
+            'client_name': 'клиент',
+            'phone': '+79990000000',
+            'delivery_address': 'адрес',
+            'delivery_window': self.window.id,
+        }
+        for _ in range(6):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url, data)
+
+        self.assertEqual(Order.objects.get(idempotency_key=data['idempotency_key']).florist, self.florists[1])
+        self.assertEqual(self.get_counts(), [2, 1, 0])
+
+    def test_florist_who_takes_order_keeps_assigned_florist(self):
+        order = self.create_order()
+        self.assertEqual(order.florist, self.florists[1])
+        self.client.force_login(self.florists[2])
+        self.client.post(reverse('floristapp:change_status', args=[order.id]), {'status': Order.Status.created})
+        self.assertEqual(Order.objects.get(id=order.id).florist, self.florists[1])
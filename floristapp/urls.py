@@ -9,5 +9,7 @@ urlpatterns = [
     path('', lambda request: redirect('floristapp:orders')),
     path('availability/', views.view_availability, name="availability"),
     path('orders/', views.view_orders, name="orders"),
+    path('orders/events/', views.order_events, name="order_events"),
     path('orders/<int:order_id>/', views.change_status, name="change_status"),
+    path('dispatch/', views.view_dispatch, name="dispatch"),
 ]
@@ -1,13 +1,41 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import user_passes_test
+from django.db.models import IntegerField, Value
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_POST
 
 from flowerapp.models import Bouquet, FlowerShop, Order
 
+from .dispatch import propose_delivery_batches
+from .hub import orders_hub
+
+# statuses of orders in queue of florists ordered by flow
+FLORIST_ORDER_STATUSES = [Order.Status.created, Order.Status.composing, Order.Status.composed]
+# statuses of orders which florists and couriers move to next status
+FLORIST_TRANSITIONS_STATUSES = [Order.Status.created, Order.Status.composing]
+COURIER_TRANSITIONS_STATUSES = [Order.Status.composed, Order.Status.delivering]
+ORDERS_PAGE_SIZE = 50
+# seconds of waiting for events of orders by long poll, it should be less than timeouts of proxies
+ORDER_EVENTS_TIMEOUT = 25
+
 
 def is_staff(user):
     return user.is_staff or user.is_florist or user.is_courier
 
 
+def get_transitions_statuses(user) -> list[str]:
+    """Get statuses of orders which user can move to next status, staff moves orders of florists and couriers"""
+    statuses = []
+    if user.is_staff or user.is_florist:
+        statuses += FLORIST_TRANSITIONS_STATUSES
+    if user.is_staff or user.is_courier:
+        statuses += COURIER_TRANSITIONS_STATUSES
+    return statuses
+
+
 @user_passes_test(is_staff, login_url='login')
 def view_availability(request):
     flower_shops = FlowerShop.objects.order_by('address')
@@ -29,28 +57,97 @@ def view_availability(request):
 
 @user_passes_test(is_staff, login_url='login')
 def view_orders(request):
-    # statuses ordered by flow
-    order_statuses = [Order.Status.created, Order.Status.composing, Order.Status.composed]
-    orders = (
+    # cursor is taken before queue, so changes made while queue is read are received by screen
+    events_cursor = orders_hub.cursor
+    orders, next_cursor = (
         Order.objects
-        .select_related('bouquet')
-        .filter(status__in=order_statuses)
-    )
-    sorted_orders = sorted(
-        orders,
-        key=lambda x: (order_statuses.index(x.status), x.created_at)
+        .select_related('bouquet', 'delivery_window', 'florist')
+        .get_queue_page(FLORIST_ORDER_STATUSES, request.GET.get('after'), ORDERS_PAGE_SIZE)
     )
-    context = {'orders': sorted_orders}
+    context = {
+        'orders': orders,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
+        'statuses': FLORIST_ORDER_STATUSES,
+        'events_cursor': events_cursor,
+    }
     return render(request, template_name='orders.html', context=context)
 
 
+@user_passes_test(is_staff, login_url='login')
+def view_dispatch(request):
+    orders = Order.objects.select_related('bouquet', 'delivery_window', 'florist').order_by('created_at', 'id')
+    context = {
+        'windows_batches': propose_delivery_batches(list(orders.filter(status=Order.Status.composed))),
+        'delivering_orders': orders.filter(status=Order.Status.delivering),
+    }
+    return render(request, template_name='dispatch.html', context=context)
+
+
+@require_POST
+@user_passes_test(is_staff, login_url='login')
 def change_status(request, order_id):
-    order = get_object_or_404(Order, pk=order_id)
+    """Move order to next status if it is still in status which florist or courier saw, return row of order
+
+    Status is changed by conditional UPDATE, so if two florists (couriers) click at once order is moved only once,
+    other one gets current row of order with status 409.
+    """
+    from_status = request.POST.get('status')
+    if from_status not in get_transitions_statuses(request.user):
+        return JsonResponse({'error': f'Статус заказа не может быть изменен: {from_status}'}, status=400)
+
+    # florist of order is assigned on creation (see floristapp.assignment), florist who takes order
+    # is florist of order only if nobody was assigned, courier who takes order is courier of order
+    fields = {}
+    if from_status == Order.Status.created and request.user.is_florist:
+        fields['florist'] = Coalesce('florist', Value(request.user.id), output_field=IntegerField())
+    elif from_status == Order.Status.composed and request.user.is_courier:
+        fields['courier'] = request.user
+    orders = Order.objects.select_related('bouquet', 'delivery_window', 'florist')
+    order = orders.transition(order_id, from_status, **fields)
+    changed = order is not None
+    if not changed:
+        order = get_object_or_404(orders, id=order_id)
+
+    return JsonResponse(
+        {
+            'id': order.id,
+            'status': order.status,
+            'changed': changed,
+            'html': render_to_string('order_row.html', {'order': order}, request=request),
+        },
+        status=200 if changed else 409
+    )
+
+
+def render_orders_events(request, events: list[dict], statuses: list[str]) -> list[dict]:
+    """Render rows of orders changed by events, row is empty if order is not in queue of statuses anymore"""
+    # only last state of order is needed
+    orders = {event['order'].id: event['order'] for event in events}
+    return [
+        {
+            'id': order.id,
+            'status': order.status,
+            'html': render_to_string('order_row.html', {'order': order}, request=request)
+            if order.status in statuses else '',
+        }
+        for order in orders.values()
+    ]
+
+
+async def order_events(request):
+    """Long poll of changes of florist queue: wait for events of orders after cursor and return rows of orders
 
-    if order.status == Order.Status.created:
-        order.status = Order.Status.composing
-    elif order.status == Order.Status.composing:
-        order.status = Order.Status.composed
-    order.save(update_fields=['status'])
+    All screens wait for events of one hub of process (see floristapp.hub), so they don't query database.
+    If events after cursor are lost, reset is true and screen should reload queue.
+    """
+    # user is loaded from session by database, so it is loaded in thread
+    is_allowed = await sync_to_async(lambda: request.user.is_authenticated and is_staff(request.user))()
+    if not is_allowed:
+        return JsonResponse({'error': 'Требуется вход'}, status=403)
 
-    return view_orders(request)
+    events, cursor = await orders_hub.wait_events(request.GET.get('after'), ORDER_EVENTS_TIMEOUT)
+    if events is None:
+        return JsonResponse({'reset': True, 'cursor': cursor, 'orders': []})
+    orders = await sync_to_async(render_orders_events)(request, events, FLORIST_ORDER_STATUSES)
+    return JsonResponse({'reset': False, 'cursor': cursor, 'orders': orders})
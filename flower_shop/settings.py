@@ -110,6 +110,27 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# for several processes use file cache: CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# and CACHE_LOCATION=/path/to/cache/dir
+
+CACHES = {
+    'default': {
+        'BACKEND': env.str('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env.str('CACHE_LOCATION', 'flower_shop'),
+    }
+}
+
+# values cached with version of data (dashboard etc.) are invalidated by version,
+# timeout only cleans old versions
+VERSIONED_CACHE_TIMEOUT = env.int('VERSIONED_CACHE_TIMEOUT', 60 * 60)
+
+# Dashboard
+# count of unique clients is approximate (error is about 1.6%) because exact count is slow for long periods
+
+DASHBOARD_EXACT_UNIQUE_CLIENTS = env.bool('DASHBOARD_EXACT_UNIQUE_CLIENTS', False)
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
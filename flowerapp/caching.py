@@ -0,0 +1,86 @@
+import datetime
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def get_data_version(namespace: str) -> int:
+    """Get current version of data in namespace, it changes on every bump_data_version
+
+    Initial version is current time in milliseconds, so if version was evicted from cache
+    new version will not be equal to one of previous versions.
+    """
+    key = f'{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_data_modified(namespace: str) -> datetime.datetime:
+    """Get time of last bump_data_version of namespace, it is time of first call if namespace wasn't bumped yet"""
+    key = f'{namespace}:modified'
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, time.time(), timeout=None)
+        modified = cache.get(key)
+    return datetime.datetime.fromtimestamp(modified, tz=datetime.timezone.utc)
+
+
+def bump_data_version(namespace: str) -> None:
+    """Invalidate all cached values of namespace"""
+    # time is changed before version, so new version never has older time
+    cache.set(f'{namespace}:modified', time.time(), timeout=None)
+    key = f'{namespace}:version'
+    try:
+        cache.incr(key)
+    except ValueError:  # version is not in cache yet
+        get_data_version(namespace)
+
+
+def get_or_compute(namespace: str, key_parts: Iterable[Any], compute: Callable[[], Any], timeout: int = None) -> Any:
+    """Get value from cache by namespace, key parts and version of namespace or compute and cache it
+
+    Value should be picklable (so no lazy QuerySets).
+    """
+    key = ':'.join([namespace, *map(str, key_parts), str(get_data_version(namespace))])
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=timeout or settings.VERSIONED_CACHE_TIMEOUT)
+    return value
+
+
+class LocalVersionedValue:
+    """Value kept in memory of this process and recomputed when its version changes
+
+    Version is usually data version of namespace, so value is recomputed in all processes after bump_data_version.
+    Value is shared between threads, so it should not be changed after computing.
+    """
+
+    def __init__(self, compute: Callable[[], Any], get_version: Callable[[], Hashable]):
+        self.compute = compute
+        self.get_version = get_version
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+
+    def get(self) -> Any:
+        version = self.get_version()
+        if self._value is not None and self._version == version:
+            return self._value
+        with self._lock:
+            if self._value is None or self._version != version:
+                # version is read before computing, so changes made during computing will cause one more computing
+                self._value, self._version = self.compute(), version
+        return self._value
+
+    def get_current(self) -> Any:
+        """Get value if it is computed for current version without computing, None otherwise"""
+        if self._value is not None and self._version == self.get_version():
+            return self._value
+        return None
@@ -0,0 +1,62 @@
+import csv
+import datetime
+import json
+from typing import Any, Iterable, Iterator
+
+from django.db import models
+from django.db.models import F
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+# rows are read from database by chunks, so memory doesn't depend on count of exported rows
+EXPORT_CHUNK_SIZE = 2000
+
+ORDER_EXPORT_FIELDS = [
+    'id', 'created_at', 'status', 'bouquet__name', 'price', 'paid', 'client_name', 'phone', 'email',
+    'delivery_address', 'delivery_window__name', 'comment', 'composed_at', 'delivered_at',
+]
+CONSULTATION_EXPORT_FIELDS = ['id', 'created_at', 'status', 'client_name', 'phone', 'event', 'budget', 'consulted_at']
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer, it returns written line instead of storing it"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def format_export_value(value: Any, tz: datetime.tzinfo) -> Any:
+    """Convert value of field to value for export, datetimes are exported in time zone tz"""
+    if isinstance(value, datetime.datetime):
+        return value.astimezone(tz).isoformat()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    # decimals
+    return str(value)
+
+
+def iter_export_rows(queryset: models.QuerySet, fields: list[str]) -> Iterator[list[Any]]:
+    tz = timezone.get_current_timezone()
+    # phones are exported as they are stored (E.164), parsing them to PhoneNumber is the slowest part of export
+    values = [Cast(field, models.CharField()) if field == 'phone' else F(field) for field in fields]
+    rows = queryset.order_by('created_at', 'id').values_list(*values).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield [format_export_value(value, tz) for value in row]
+
+
+def iter_csv_lines(rows: Iterable[list[Any]], fields: list[str]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl_lines(rows: Iterable[list[Any]], fields: list[str]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), ensure_ascii=False) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', iter_csv_lines),
+    'jsonl': ('application/x-ndjson; charset=utf-8', iter_jsonl_lines),
+}
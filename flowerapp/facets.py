@@ -0,0 +1,173 @@
+import bisect
+from typing import Any, Iterator, Optional
+
+from .caching import LocalVersionedValue, get_data_version
+from .models import Bouquet
+from .models import decode_catalog_cursor
+from .models import encode_catalog_cursor
+
+# bands are half-open [from, to), None is not bounded side
+PRICE_BANDS = {
+    'cheap': ('До 1 000 руб', None, 1000),
+    'middle': ('1 000 - 5 000 руб', 1000, 5000),
+    'expensive': ('От 5 000 руб', 5000, None),
+}
+# size of bouquet is its biggest side
+SIZE_BANDS = {
+    'small': ('Маленький, до 40 см', None, 40),
+    'medium': ('Средний, 40 - 60 см', 40, 60),
+    'large': ('Большой, от 60 см', 60, None),
+}
+FACETS_TITLES = {
+    'event': 'Повод',
+    'price': 'Цена',
+    'size': 'Размер',
+    'flower': 'Состав',
+}
+
+
+def get_band(value: Any, bands: dict[str, tuple[str, Any, Any]]) -> Optional[str]:
+    for band, (_, band_from, band_to) in bands.items():
+        if (band_from is None or value >= band_from) and (band_to is None or value < band_to):
+            return band
+    return None
+
+
+def iter_bits(bits: int, start: int = 0) -> Iterator[int]:
+    """Iterate positions of set bits not less than start in ascending order"""
+    bits >>= start
+    while bits:
+        lowest_bit = bits & -bits
+        yield start + lowest_bit.bit_length() - 1
+        bits ^= lowest_bit
+
+
+def count_bits(bits: int) -> int:
+    return bin(bits).count('1')
+
+
+class FacetIndex:
+    """Bitsets of bouquets for every value of every facet of catalog
+
+    Bit i of bitset is bouquet with position i in catalog (ordered by price and id), so intersection of facets
+    is bitwise and, count of bouquets is count of set bits and pages are taken by positions of set bits.
+    Values of one facet are combined by "or", facets are combined by "and".
+    """
+
+    def __init__(self, bouquets: list[Bouquet], values_titles: dict[str, dict[str, str]]):
+        """values_titles are titles of values of facets which are not bands (events and flowers)"""
+        self.bouquets = sorted(bouquets, key=lambda bouquet: (bouquet.price, bouquet.id))
+        self.positions_keys = [(bouquet.price, bouquet.id) for bouquet in self.bouquets]
+        self.all_bits = (1 << len(self.bouquets)) - 1
+
+        self.values_titles = {
+            **values_titles,
+            'price': {band: title for band, (title, _, _) in PRICE_BANDS.items()},
+            'size': {band: title for band, (title, _, _) in SIZE_BANDS.items()},
+        }
+        self.bits = {facet: {value: 0 for value in self.values_titles[facet]} for facet in FACETS_TITLES}
+        for position, bouquet in enumerate(self.bouquets):
+            bit = 1 << position
+            bouquet_values = {
+                'event': [str(event.id) for event in bouquet.events.all()],
+                'price': [get_band(bouquet.price, PRICE_BANDS)],
+                'size': [get_band(max(bouquet.height_cm, bouquet.width_cm), SIZE_BANDS)],
+                'flower': [str(bouquet_item.item_id) for bouquet_item in bouquet.items.all()],
+            }
+            for facet, values in bouquet_values.items():
+                for value in values:
+                    if value in self.bits[facet]:
+                        self.bits[facet][value] |= bit
+
+    @classmethod
+    def build(cls) -> 'FacetIndex':
+        bouquets = list(Bouquet.objects.prefetch_related('events', 'items', 'items__item'))
+        values_titles = {'event': {}, 'flower': {}}
+        for bouquet in bouquets:
+            for event in bouquet.events.all():
+                values_titles['event'][str(event.id)] = event.name
+            for bouquet_item in bouquet.items.all():
+                values_titles['flower'][str(bouquet_item.item_id)] = bouquet_item.item.name
+        # values without bouquets are not shown, they always have zero count
+        values_titles = {
+            facet: dict(sorted(titles.items(), key=lambda value_title: value_title[1]))
+            for facet, titles in values_titles.items()
+        }
+        return cls(bouquets, values_titles)
+
+    def clean_selection(self, selection: dict[str, list[str]]) -> dict[str, list[str]]:
+        """Drop unknown facets and values from selection and facets without selected values"""
+        cleaned_selection = {}
+        for facet, values in selection.items():
+            values = [value for value in values if value in self.bits.get(facet, {})]
+            if values:
+                cleaned_selection[facet] = values
+        return cleaned_selection
+
+    def get_facet_bits(self, facet: str, values: list[str]) -> int:
+        bits = 0
+        for value in values:
+            bits |= self.bits[facet][value]
+        return bits
+
+    def get_selected_bits(self, selection: dict[str, list[str]], exclude_facet: Optional[str] = None) -> int:
+        """Get bitset of bouquets matched selection, facet exclude_facet is ignored"""
+        bits = self.all_bits
+        for facet, values in selection.items():
+            if facet != exclude_facet:
+                bits &= self.get_facet_bits(facet, values)
+        return bits
+
+    def get_facets(self, selection: dict[str, list[str]]) -> list[dict[str, Any]]:
+        """Get facets with values, their counts and selection for catalog filter
+
+        Count of value is count of bouquets matched selection of other facets and this value,
+        so it is count of bouquets which will be added to results by selecting this value.
+        """
+        selection = self.clean_selection(selection)
+        facets = []
+        for facet, facet_title in FACETS_TITLES.items():
+            other_facets_bits = self.get_selected_bits(selection, exclude_facet=facet)
+            facets.append({
+                'name': facet,
+                'title': facet_title,
+                'values': [
+                    {
+                        'value': value,
+                        'title': self.values_titles[facet][value],
+                        'count': count_bits(other_facets_bits & value_bits),
+                        'selected': value in selection.get(facet, []),
+                    }
+                    for value, value_bits in self.bits[facet].items()
+                ],
+            })
+        return facets
+
+    def count(self, selection: dict[str, list[str]]) -> int:
+        return count_bits(self.get_selected_bits(self.clean_selection(selection)))
+
+    def get_catalog_page(
+        self,
+        selection: dict[str, list[str]],
+        cursor: Optional[str],
+        size: int
+    ) -> tuple[list[Bouquet], Optional[str]]:
+        """Same as BouquetQuerySet.get_catalog_page but only for bouquets matched selection of facets"""
+        bits = self.get_selected_bits(self.clean_selection(selection))
+        position = decode_catalog_cursor(cursor)
+        start = bisect.bisect_right(self.positions_keys, position) if position else 0
+
+        page = []
+        for bouquet_position in iter_bits(bits, start):
+            page.append(self.bouquets[bouquet_position])
+            if len(page) > size:
+                return page[:size], encode_catalog_cursor(page[size - 1])
+        return page, None
+
+
+# catalog version is bumped by changes of bouquets, events and items of bouquets (see flowerapp.signals)
+_facet_index = LocalVersionedValue(FacetIndex.build, lambda: get_data_version('catalog'))
+
+
+def get_facet_index() -> FacetIndex:
+    return _facet_index.get()
@@ -1,9 +1,11 @@
+import uuid
+
 from django import forms
 from phonenumber_field.formfields import PhoneNumberField
 from phonenumber_field.widgets import RegionalPhoneNumberWidget
 
 from .models import Consultation
-from .models import DeliveryWindow
+from .models import get_delivery_windows
 
 
 class ConsultationForm(forms.ModelForm):
@@ -68,12 +70,8 @@ class CustomEventForm(forms.Form):
 
 
 class OrderForm(forms.Form):
-    CHOICES = []
-    windows = DeliveryWindow.objects.all().values()[::1]
-    for window in windows:
-        wind = (window['id'], window['name'])
-        CHOICES.append(wind)
-    
+    # new key for every rendered form, so submits of one form create one order
+    idempotency_key = forms.UUIDField(widget=forms.HiddenInput, initial=uuid.uuid4, required=False)
     client_name = forms.CharField(max_length=200, label='', 
                             widget=forms.TextInput(attrs={
                                 'name': 'fname',
@@ -101,7 +99,9 @@ class OrderForm(forms.Form):
                             error_messages={
                                 'required': 'Поле "Адрес" не должно быть пустым'
                             })
-    delivery_window = forms.ChoiceField(widget=forms.RadioSelect(attrs={'class': 'order__form_radio'}), choices=CHOICES,
+    # choices are read on every render and validation, so changes of windows are shown without restart
+    delivery_window = forms.ChoiceField(widget=forms.RadioSelect(attrs={'class': 'order__form_radio'}),
+                            choices=get_delivery_windows,
                             error_messages={
                                 'required': 'Необходимо выбрать окно для доставки'
                             })
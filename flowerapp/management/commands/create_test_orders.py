@@ -8,6 +8,8 @@ from django.utils import timezone
 from flowerapp.models import Bouquet
 from flowerapp.models import DeliveryWindow
 from flowerapp.models import Order
+from flowerapp.models import OrderRollup
+from flowerapp.signals import rollups_maintenance_suspended
 
 User = get_user_model()
 
@@ -36,7 +38,8 @@ class Command(BaseCommand):
         delivery_windows = list(DeliveryWindow.objects.all())
         bouquets = list(Bouquet.objects.all())
 
-        Order.objects.filter(delivery_address__contains='delivery_address_').delete()
+        with rollups_maintenance_suspended():
+            Order.objects.filter(delivery_address__contains='delivery_address_').delete()
         User.objects.filter(username__contains='florist_').delete()
         User.objects.filter(username__contains='courier_').delete()
 
@@ -126,3 +129,7 @@ class Command(BaseCommand):
                 orders.append(order)
             Order.objects.bulk_create(orders)
             print(f'day={day} handled, {len(orders)} orders')
+
+        # bulk_create does not send signals, so rollups should be rebuilt
+        rollups_count = OrderRollup.objects.rebuild()
+        print(f'rollups rebuilt, {rollups_count} rollups')
@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
 
 from flowerapp.models import Order
+from flowerapp.models import OrderRollup
+from flowerapp.signals import rollups_maintenance_suspended
 
 User = get_user_model()
 
@@ -10,6 +12,8 @@ class Command(BaseCommand):
     help = "Delete test orders"
 
     def handle(self, *args, **kwargs):
-        Order.objects.filter(delivery_address__contains='delivery_address_').delete()
+        with rollups_maintenance_suspended():
+            Order.objects.filter(delivery_address__contains='delivery_address_').delete()
+        OrderRollup.objects.rebuild()
         User.objects.filter(username__contains='florist_').delete()
         User.objects.filter(username__contains='courier_').delete()
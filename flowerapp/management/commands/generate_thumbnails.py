@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from flowerapp.models import Bouquet
+from flowerapp.thumbnails import generate_thumbnails, refresh_bouquets_tiles
+
+
+def generate_photo_thumbnails(photo_name: str, force: bool) -> tuple[str, list[str]]:
+    """Generate thumbnails in separate process, images are resized in parallel on all cores"""
+    return photo_name, generate_thumbnails(photo_name, force)
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails of photos of all bouquets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='count of processes')
+        parser.add_argument('--force', action='store_true', help='regenerate existing thumbnails')
+
+    def handle(self, *args, **options):
+        photos_names = sorted(set(Bouquet.objects.exclude(photo='').values_list('photo', flat=True)))
+        failed_photos_names = []
+        generated_photos_names = []
+        # processes don't use database, but they should have configured Django for storage
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            results = executor.map(generate_photo_thumbnails, photos_names, [options['force']] * len(photos_names))
+            for photo_name, thumbnails_names in results:
+                if thumbnails_names is None:
+                    failed_photos_names.append(photo_name)
+                    print(f'{photo_name}: photo can not be read')
+                elif thumbnails_names:
+                    generated_photos_names.append(photo_name)
+                    print(f'{photo_name}: {len(thumbnails_names)} thumbnails generated')
+                else:
+                    print(f'{photo_name}: thumbnails already exist')
+        if generated_photos_names:
+            refresh_bouquets_tiles(generated_photos_names)
+        print(f'thumbnails of {len(photos_names) - len(failed_photos_names)} photos of {len(photos_names)} are ready')
@@ -0,0 +1,119 @@
+import random
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from flowerapp.models import Bouquet
+from flowerapp.models import Order
+from flowerapp.models import OrderRollup
+from flowerapp.models import get_delivery_windows
+from flowerapp.signals import rollups_maintenance_suspended
+from flowerapp.views import order
+
+
+class Command(BaseCommand):
+    help = "Place orders by order view in parallel threads and print orders per second"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help='count of submits of order form')
+        parser.add_argument('--threads', type=int, default=4, help='count of parallel clients')
+        parser.add_argument('--duplicates', type=float, default=0.1, help='share of repeated submits of forms')
+        parser.add_argument('--journal-mode', choices=['delete', 'truncate', 'persist', 'wal'],
+                            help='journal mode of SQLite database during test, by default mode is not changed')
+        parser.add_argument('--keep', action='store_true', help="don't delete created orders")
+
+    def handle(self, *args, **options):
+        journal_mode = options['journal_mode']
+        if connection.vendor != 'sqlite' or not journal_mode:
+            self.run_load_test(options)
+            return
+
+        # journal mode is stored in database file, so previous mode is restored after test
+        previous_journal_mode = self.set_journal_mode(journal_mode)
+        try:
+            self.run_load_test(options)
+        finally:
+            self.set_journal_mode(previous_journal_mode)
+
+    @staticmethod
+    def set_journal_mode(journal_mode: str) -> str:
+        """Set journal mode of SQLite database and return previous mode"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            previous_journal_mode = cursor.fetchone()[0]
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+            print(f'journal mode: {cursor.fetchone()[0]}')
+        return previous_journal_mode
+
+    def run_load_test(self, options):
+        bouquet = Bouquet.objects.first()
+        windows = get_delivery_windows()
+        if not bouquet or not windows:
+            print('bouquets and delivery windows are required for load test')
+            return
+
+        # repeated submits reuse key of one of previous forms, it can be submitted by other thread at the same time
+        keys = []
+        for _ in range(options['orders']):
+            is_duplicate = keys and random.random() < options['duplicates']
+            keys.append(random.choice(keys) if is_duplicate else uuid.uuid4())
+
+        # orders of this run are found by address
+        delivery_address = f'load_test_address_{uuid.uuid4().hex[:8]}'
+        url = reverse('order', args=[bouquet.id])
+        factory = RequestFactory()
+
+        def submit_forms(thread_number: int) -> list[float]:
+            latencies = []
+            try:
+                for key in keys[thread_number::options['threads']]:
+                    request = factory.post(url, {
+                        'idempotency_key': key,
+                        'client_name': 'load test',
+                        'phone': '+79000000000',
+                        'delivery_address': delivery_address,
+                        'delivery_window': random.choice(windows)[0],
+                    })
+                    start = time.perf_counter()
+                    response = order(request, bouquet.id)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 302:
+                        print(f'order is not placed, status {response.status_code}')
+            finally:
+                # every thread has its own connection
+                connection.close()
+            return latencies
+
+        first_day = timezone.localdate()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            latencies = sorted(
+                latency
+                for thread_latencies in executor.map(submit_forms, range(options['threads']))
+                for latency in thread_latencies
+            )
+        duration = time.perf_counter() - start
+
+        orders = Order.objects.filter(delivery_address=delivery_address)
+        orders_count = orders.count()
+        print(f'{len(keys)} submits, {len(set(keys))} unique forms, {orders_count} orders created')
+        print(f'{len(keys) / duration:.0f} submits/s, {orders_count / duration:.0f} orders/s')
+        print(
+            f'latency p50 {statistics.median(latencies) * 1000:.1f} ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, '
+            f'max {latencies[-1] * 1000:.1f} ms'
+        )
+
+        if not options['keep']:
+            # rollups of days of test are rebuilt once instead of update by every deleted order
+            with rollups_maintenance_suspended():
+                orders.delete()
+            OrderRollup.objects.rebuild(first_day, timezone.localdate())
+            print(f'{orders_count} test orders deleted, rollups rebuilt')
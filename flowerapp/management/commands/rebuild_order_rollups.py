@@ -0,0 +1,95 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from flowerapp.models import Order
+from flowerapp.models import OrderDailySketch
+from flowerapp.models import OrderRollup
+
+
+def compute_chunk(
+    date_from: datetime.date,
+    date_to: datetime.date
+) -> tuple[list[OrderRollup], list[OrderDailySketch]]:
+    """Compute rollups and daily sketches of chunk in separate thread, every thread has own connection to database."""
+    try:
+        return OrderRollup.objects.compute(date_from, date_to), OrderDailySketch.objects.compute(date_from, date_to)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Rebuild rollups and daily sketches of orders for dashboard by chunks of days and check them with orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=datetime.date.fromisoformat, help='first day, YYYY-MM-DD')
+        parser.add_argument('--date-to', type=datetime.date.fromisoformat, help='last day, YYYY-MM-DD')
+        parser.add_argument('--chunk-days', type=int, default=31, help='count of days in one chunk')
+        parser.add_argument('--workers', type=int, default=4, help='count of chunks computed in parallel')
+        parser.add_argument('--no-check', action='store_true', help='do not compare rollups with orders')
+
+    def handle(self, *args, **options):
+        date_from, date_to = self.get_date_range(options['date_from'], options['date_to'])
+        if not date_from:
+            print('there are no orders and rollups, nothing to rebuild')
+            return
+
+        chunks = []
+        chunk_from = date_from
+        while chunk_from <= date_to:
+            chunk_to = min(chunk_from + datetime.timedelta(days=options['chunk_days'] - 1), date_to)
+            chunks.append((chunk_from, chunk_to))
+            chunk_from = chunk_to + datetime.timedelta(days=1)
+
+        # orders are read in parallel, but rollups are written by one thread because SQLite has one writer
+        rollups_count = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(compute_chunk, chunk_from, chunk_to) for chunk_from, chunk_to in chunks]
+            for (chunk_from, chunk_to), future in zip(chunks, futures):
+                chunk_rollups, chunk_sketches = future.result()
+                chunk_rollups_count = OrderRollup.objects.replace(chunk_rollups, chunk_from, chunk_to)
+                OrderDailySketch.objects.replace(chunk_sketches, chunk_from, chunk_to)
+                rollups_count += chunk_rollups_count
+                print(f'days {chunk_from} - {chunk_to} rebuilt, {chunk_rollups_count} rollups')
+        print(f'rollups rebuilt, {rollups_count} rollups')
+
+        if options['no_check']:
+            return
+
+        mismatched_days = OrderRollup.objects.get_mismatched_days(date_from, date_to)
+        if mismatched_days:
+            raise CommandError(f'rollups differ from orders in days: {", ".join(map(str, mismatched_days))}')
+        mismatched_days = OrderDailySketch.objects.get_mismatched_days(date_from, date_to)
+        if mismatched_days:
+            raise CommandError(f'sketches differ from rollups in days: {", ".join(map(str, mismatched_days))}')
+        print('rollups are equal to orders')
+
+    @staticmethod
+    def get_date_range(
+        date_from: Optional[datetime.date],
+        date_to: Optional[datetime.date]
+    ) -> tuple[Optional[datetime.date], Optional[datetime.date]]:
+        """Fill not passed bounds by first and last days of orders and rollups"""
+        if date_from and date_to:
+            return date_from, date_to
+
+        orders_range = Order.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        rollups_range = OrderRollup.objects.aggregate(first=Min('day'), last=Max('day'))
+        first_days = [
+            day
+            for day in (orders_range['first'] and timezone.localdate(orders_range['first']), rollups_range['first'])
+            if day
+        ]
+        last_days = [
+            day
+            for day in (orders_range['last'] and timezone.localdate(orders_range['last']), rollups_range['last'])
+            if day
+        ]
+        if not first_days:
+            return None, None
+        return date_from or min(first_days), date_to or max(last_days)
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:02
+
+import datetime
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowerapp', '0009_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True, verbose_name='день создания заказов')),
+                ('hour', models.PositiveSmallIntegerField(validators=[django.core.validators.MaxValueValidator(23)], verbose_name='час создания заказов')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='количество заказов')),
+                ('orders_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='сумма заказов')),
+                ('order_to_compose_total', models.DurationField(default=datetime.timedelta, verbose_name='суммарное время от заказа до сбора')),
+                ('order_to_compose_count', models.PositiveIntegerField(default=0, verbose_name='количество собранных заказов')),
+                ('compose_to_delivery_total', models.DurationField(default=datetime.timedelta, verbose_name='суммарное время от сбора до доставки')),
+                ('compose_to_delivery_count', models.PositiveIntegerField(default=0, verbose_name='количество доставленных собранных заказов')),
+                ('order_to_delivery_total', models.DurationField(default=datetime.timedelta, verbose_name='суммарное время от заказа до доставки')),
+                ('order_to_delivery_count', models.PositiveIntegerField(default=0, verbose_name='количество доставленных заказов')),
+                ('bouquet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='flowerapp.bouquet', verbose_name='букет')),
+                ('delivery_window', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='flowerapp.deliverywindow', verbose_name='окно доставки')),
+            ],
+            options={
+                'verbose_name': 'агрегат заказов',
+                'verbose_name_plural': 'агрегаты заказов',
+                'unique_together': {('day', 'hour', 'bouquet', 'delivery_window')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowerapp', '0011_order_created_at_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailySketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True, verbose_name='день создания заказов')),
+                ('durations', models.JSONField(default=dict, verbose_name='скетчи длительностей')),
+                ('bouquet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sketches', to='flowerapp.bouquet', verbose_name='букет')),
+            ],
+            options={
+                'verbose_name': 'скетч заказов за день',
+                'verbose_name_plural': 'скетчи заказов за день',
+                'unique_together': {('day', 'bouquet')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowerapp', '0012_orderdailysketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderdailysketch',
+            name='clients',
+            field=models.JSONField(default=dict, verbose_name='скетч клиентов'),
+        ),
+    ]
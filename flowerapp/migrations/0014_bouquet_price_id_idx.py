@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowerapp', '0013_orderdailysketch_clients'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bouquet',
+            index=models.Index(fields=['price', 'id'], name='bouquet_price_id_idx'),
+        ),
+    ]
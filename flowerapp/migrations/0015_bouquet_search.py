@@ -0,0 +1,51 @@
+from django.db import migrations
+
+from flowerapp.stemmer import get_search_text
+
+SEARCH_TABLE = 'flowerapp_bouquet_search'
+
+
+def create_search_index(apps, schema_editor):
+    """Create FTS5 table with stems of names, descriptions and items of bouquets, only SQLite has it"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            f"name, description, items, tokenize = 'unicode61 remove_diacritics 0')"
+        )
+
+        Bouquet = apps.get_model('flowerapp', 'Bouquet')
+        rows = [
+            (
+                bouquet.id,
+                get_search_text([bouquet.name]),
+                get_search_text([bouquet.description]),
+                get_search_text(bouquet_item.item.name for bouquet_item in bouquet.items.all()),
+            )
+            for bouquet in Bouquet.objects.prefetch_related('items__item')
+        ]
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, items) VALUES (%s, %s, %s, %s)',
+            rows
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowerapp', '0014_bouquet_price_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
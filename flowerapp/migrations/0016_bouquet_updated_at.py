@@ -0,0 +1,20 @@
+# Generated by Django 3.2.16 on 2026-10-18 21:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowerapp', '0015_bouquet_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bouquet',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='обновлен'),
+            preserve_default=False,
+        ),
+    ]
@@ -1,16 +1,27 @@
 import datetime
-from typing import Any
+import uuid
+from decimal import Decimal, InvalidOperation
+from typing import Any, Iterable, Optional
 
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models import F, Count, Min, Case, When, Value, Avg, Sum
-from django.db.models.functions import TruncDate, Concat
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Count, Min, Case, When, Avg, Sum, Value
+from django.db.models.functions import Trunc, TruncDate, ExtractHour, ExtractIsoWeekDay, Coalesce
+from django.dispatch import Signal
 from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
+from .caching import bump_data_version
+from .caching import get_or_compute
+from .sketches import ClientsSketch, DurationSketch
+
 User = get_user_model()
 
+# sent by OrderQuerySet.transition with changed order and its previous status, order is changed by UPDATE,
+# so post_save is not sent
+order_status_changed = Signal()
+
 
 class Event(models.Model):
     name = models.CharField('название', max_length=200, unique=True)
@@ -23,36 +34,40 @@ class Event(models.Model):
         return self.name
 
 
+def encode_catalog_cursor(bouquet: 'Bouquet') -> str:
+    """Encode position of bouquet in catalog (ordered by price and id) to string for url"""
+    return f'{bouquet.price}_{bouquet.id}'
+
+
+def decode_catalog_cursor(cursor: Optional[str]) -> Optional[tuple[Decimal, int]]:
+    """Decode price and id of bouquet from cursor, None if cursor is not passed or invalid"""
+    price, _, bouquet_id = (cursor or '').partition('_')
+    try:
+        price, bouquet_id = Decimal(price), int(bouquet_id)
+    except (InvalidOperation, ValueError):
+        return None
+    # NaN can't be compared with prices and infinity is not a price of bouquet
+    return (price, bouquet_id) if price.is_finite() else None
+
+
 class BouquetQuerySet(models.QuerySet):
-    def get_recommended_bouquet(self, event: str, price_from: str, price_to: str) -> 'Bouquet':
-        """
-        Get bouquet by recommendation algorithm
+    def get_catalog_page(self, cursor: Optional[str], size: int) -> tuple[list['Bouquet'], Optional[str]]:
+        """Get page of bouquets ordered by price and id after cursor and cursor of next page (None for last page)
 
-        Algorithm: filter by event and price range and return most expensive bouquet after filter
-        If no bouquets after filter return just most expensive bouquet
+        Page is found by index of price and id (keyset pagination), so cost of page doesn't depend on its depth.
         """
-        params = {}
-        if event:
-            try:
-                Event.objects.get(id=event)
-                params['events__id__in'] = event
-            except Event.DoesNotExist:
-                pass
-
-        for price, price_lookup in {price_from: 'gte', price_to: 'lte'}.items():
-            if price:
-                try:
-                    float(price)
-                    params[f'price__{price_lookup}'] = price
-                except ValueError:
-                    pass
-
-        recommended_bouquets = self.filter(**params).order_by(
-            '-price').prefetch_related('items', 'items__item')
-        all_bouquets = self.order_by('-price').prefetch_related('items', 'items__item')
-
-        # economy 1 query because of lazy QuerySet and lazy python logic if recommended_bouquets exists
-        return recommended_bouquets.first() or all_bouquets.first()
+        bouquets = self.order_by('price', 'id')
+        position = decode_catalog_cursor(cursor)
+        if position:
+            price, bouquet_id = position
+            # price__gte is redundant, but with it database searches index from cursor instead of scanning it
+            bouquets = bouquets.filter(Q(price__gt=price) | Q(id__gt=bouquet_id), price__gte=price)
+
+        # one more bouquet to know if there is next page
+        page = list(bouquets[:size + 1])
+        if len(page) > size:
+            return page[:size], encode_catalog_cursor(page[size - 1])
+        return page, None
 
 
 class Bouquet(models.Model):
@@ -72,12 +87,17 @@ class Bouquet(models.Model):
     )
     events = models.ManyToManyField(Event)
     is_recommended = models.BooleanField('рекомендованный', default=False)
+    # changed on every save, it is version of cached tiles of bouquet in templates
+    updated_at = models.DateTimeField('обновлен', auto_now=True)
 
     objects = BouquetQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'букет'
         verbose_name_plural = 'букеты'
+        indexes = [
+            models.Index(fields=['price', 'id'], name='bouquet_price_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -173,72 +193,276 @@ class DeliveryWindow(models.Model):
         return self.name
 
 
+def get_delivery_windows() -> list[tuple[int, str]]:
+    """Get ids and names of delivery windows, they are cached until windows are changed (see flowerapp.signals)"""
+    return get_or_compute(
+        'delivery_windows',
+        ['windows'],
+        lambda: list(DeliveryWindow.objects.values_list('id', 'name'))
+    )
+
+
+# pairs of points of order (create, compose and delivery time), time between them is measured by dashboard
+ORDER_POINTS = ['order_to_delivery', 'order_to_compose', 'compose_to_delivery']
+
+
+def get_day_start(day: datetime.date) -> datetime.datetime:
+    """Get midnight of day in current time zone"""
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def to_percent_distribution(by_hours_distribution: Iterable[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Convert rows with hour and num of orders to rows with hour and percent of all orders in these hours."""
+    by_hours_distribution = list(by_hours_distribution)
+    all_count = sum([item['num'] for item in by_hours_distribution])
+    return [
+        {
+            'hour': item['hour'],
+            'percent': str(round((item['num'] / all_count) * 100, 1)).replace(',', '.')
+        }
+        for item
+        in by_hours_distribution
+    ]
+
+
+def to_weekday_hour_matrix(rows: Iterable[dict[str, Any]]) -> list[list[int]]:
+    """Convert rows with ISO weekday (1 is Monday), hour and num of orders to 7x24 matrix of counts of orders"""
+    matrix = [[0] * 24 for _ in range(7)]
+    for row in rows:
+        matrix[row['weekday'] - 1][row['hour']] += row['num']
+    return matrix
+
+
+# granularities of time series from finest to coarsest
+TIME_SERIES_GRANULARITIES = ['hour', 'day', 'week', 'month']
+# chart of time series should be cheap to compute and to draw, so count of its buckets is limited
+MAX_TIME_SERIES_BUCKETS = 400
+TIME_SERIES_BUCKET_MAX_SIZES = {
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(days=7),
+    'month': datetime.timedelta(days=28),
+}
+
+
+def get_default_granularity(period: str) -> str:
+    """Get granularity of orders time series for period of dashboard
+
+    Granularity for all time is day, it is coarsened to week or month if there are too many days.
+    """
+    if period == Order.DashboardFilterPeriod.today.name:
+        return 'hour'
+    if period in (
+        Order.DashboardFilterPeriod.year.name,
+        Order.DashboardFilterPeriod.this_year.name,
+        Order.DashboardFilterPeriod.previous_year.name,
+    ):
+        return 'month'
+    return 'day'
+
+
+def fit_granularity(start: datetime.datetime, end: datetime.datetime, granularity: str) -> str:
+    """Get granularity not finer than granularity with not more than MAX_TIME_SERIES_BUCKETS buckets in [start, end)"""
+    for fitted_granularity in TIME_SERIES_GRANULARITIES[TIME_SERIES_GRANULARITIES.index(granularity):]:
+        if (end - start) / TIME_SERIES_BUCKET_MAX_SIZES[fitted_granularity] < MAX_TIME_SERIES_BUCKETS:
+            return fitted_granularity
+    return TIME_SERIES_GRANULARITIES[-1]
+
+
+def truncate_to_bucket(moment: datetime.datetime, granularity: str) -> datetime.datetime:
+    """Get start of bucket of naive local datetime, weeks start on Monday"""
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = datetime.datetime.combine(moment.date(), datetime.time.min)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def get_next_bucket(bucket: datetime.datetime, granularity: str) -> datetime.datetime:
+    if granularity == 'month':
+        return (bucket + datetime.timedelta(days=31)).replace(day=1)
+    return bucket + TIME_SERIES_BUCKET_MAX_SIZES[granularity]
+
+
+def fill_time_series(
+    counts: dict[datetime.datetime, int],
+    start: datetime.datetime,
+    end: datetime.datetime,
+    granularity: str
+) -> list[dict[str, Any]]:
+    """Get rows with start of bucket (naive local datetime) and count of orders for every bucket in [start, end)
+
+    Buckets without orders have zero count, so there are no gaps in time series.
+    """
+    time_series = []
+    bucket = truncate_to_bucket(timezone.make_naive(start), granularity)
+    naive_end = timezone.make_naive(end)
+    while bucket < naive_end:
+        time_series.append({'t': bucket, 'num': counts.get(bucket, 0)})
+        bucket = get_next_bucket(bucket, granularity)
+    return time_series
+
+
+def pop_most_popular_window(summary: dict[str, Any], windows: Iterable[tuple[int, str]]) -> Optional[str]:
+    """Pop counts of orders by delivery windows (window_<id> keys) from summary and return name of most popular window
+
+    Return None if there are no orders with delivery window.
+    """
+    most_popular_window, most_popular_window_count = None, 0
+    for window_id, window_name in windows:
+        window_count = summary.pop(f'window_{window_id}') or 0
+        if window_count > most_popular_window_count:
+            most_popular_window, most_popular_window_count = window_name, window_count
+    return most_popular_window
+
+
+QUEUE_CURSOR_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_queue_cursor(order: 'Order') -> str:
+    """Encode position of order annotated by status rank in queue (see OrderQuerySet.get_queue_page) for url
+
+    Time of creation is in microseconds, so it is exact.
+    """
+    created_at = (order.created_at - QUEUE_CURSOR_EPOCH) // datetime.timedelta(microseconds=1)
+    return f'{order.status_rank}_{created_at}_{order.id}'
+
+
+def decode_queue_cursor(cursor: Optional[str]) -> Optional[tuple[int, datetime.datetime, int]]:
+    """Decode status rank, time of creation and id of order from cursor, None if cursor is not passed or invalid"""
+    try:
+        status_rank, created_at, order_id = map(int, (cursor or '').split('_'))
+        return status_rank, QUEUE_CURSOR_EPOCH + datetime.timedelta(microseconds=created_at), order_id
+    except (ValueError, OverflowError):
+        return None
+
+
 class OrderQuerySet(models.QuerySet):
+    def annotate_status_rank(self, statuses: list[str]) -> models.QuerySet:
+        """Annotate position of status of order in statuses, orders with other statuses are excluded"""
+        return self.filter(status__in=statuses).annotate(
+            status_rank=Case(
+                *[When(status=status, then=Value(rank)) for rank, status in enumerate(statuses)],
+                output_field=models.IntegerField(),
+            )
+        )
+
+    def get_queue_page(
+        self,
+        statuses: list[str],
+        cursor: Optional[str],
+        size: int
+    ) -> tuple[list['Order'], Optional[str]]:
+        """Get page of queue of orders after cursor and cursor of next page (None for last page)
+
+        Queue is orders with statuses ordered by position of status in statuses, created_at and id.
+        Orders after cursor are orders with next statuses and later orders with status of cursor,
+        so they are found by index of status and created_at and cost of page doesn't depend on its depth.
+        """
+        orders = self.annotate_status_rank(statuses)
+        position = decode_queue_cursor(cursor)
+        if position and 0 <= position[0] < len(statuses):
+            status_rank, created_at, order_id = position
+            status = statuses[status_rank]
+            orders = orders.filter(
+                Q(status__in=statuses[status_rank + 1:])
+                | Q(status=status, created_at__gt=created_at)
+                | Q(status=status, created_at=created_at, id__gt=order_id)
+            )
+
+        # one more order to know if there is next page
+        orders = list(orders.order_by('status_rank', 'created_at', 'id')[:size + 1])
+        if len(orders) > size:
+            return orders[:size], encode_queue_cursor(orders[size - 1])
+        return orders, None
+
+    def transition(self, order_id: int, from_status: str, **fields) -> Optional['Order']:
+        """Move order from from_status to next status (see Order.TRANSITIONS) by one conditional UPDATE
+
+        Time of transition is stamped to field of next status and fields are set (for example florist)
+        in the same UPDATE. Return changed order or None if order is not in from_status anymore,
+        so of simultaneous transitions only one is done.
+        """
+        to_status, stamp_field = Order.TRANSITIONS[from_status]
+        if stamp_field:
+            fields[stamp_field] = timezone.now()
+        with transaction.atomic():
+            if not self.filter(id=order_id, status=from_status).update(status=to_status, **fields):
+                return None
+            order = self.get(id=order_id)
+            order_status_changed.send(sender=Order, order=order, old_status=from_status)
+        return order
+
+    def create_once(self, idempotency_key: uuid.UUID, **fields) -> tuple['Order', bool]:
+        """Create order with idempotency key or get order which was created with this key before
+
+        Return order and True if it is created. Insert is tried first, so new order is one write without reads,
+        and it is in one transaction with rollups of order (see flowerapp.signals).
+        """
+        try:
+            with transaction.atomic():
+                return self.create(idempotency_key=idempotency_key, **fields), True
+        except IntegrityError:
+            order = self.filter(idempotency_key=idempotency_key).first()
+            if order is None:  # error is not caused by repeated key
+                raise
+            return order, False
+
+    def created_in_days(
+        self,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> models.QuerySet:
+        """Filter orders created in days between date_from and date_to (both included), None date is not bound"""
+        orders = self
+        if date_from:
+            orders = orders.filter(created_at__gte=get_day_start(date_from))
+        if date_to:
+            orders = orders.filter(created_at__lt=get_day_start(date_to + datetime.timedelta(days=1)))
+        return orders
+
     def get_by_hours_distribution(self) -> list[dict[str, Any]]:
         """Get distribution of order hour and percent of all orders in these hours through all orders in self."""
-        by_hours_distribution = list(self.annotate(hour=F('created_at__hour')).values('hour').annotate(
-            num=Count('hour')).order_by('hour'))
-        all_count = sum([item['num'] for item in by_hours_distribution])
-        return [
-            {
-                'hour': item['hour'],
-                'percent': str(round((item['num'] / all_count) * 100, 1)).replace(',', '.')
-            }
-            for item
-            in by_hours_distribution
-        ]
+        by_hours_distribution = self.annotate(hour=F('created_at__hour')).values('hour').annotate(
+            num=Count('hour')).order_by('hour')
+        return to_percent_distribution(by_hours_distribution)
 
-    def get_by_time_distribution(self, period: str) -> models.QuerySet:
-        """Get distribution of time unit (depends on period parameter) and count of orders"""
-        first_order_dt = self.aggregate(dt=Min('created_at'))['dt'] or timezone.now()
-        show_days_maximal_days_limit = 120
-        show_months_maximal_days_limit = 365 * 2
-
-        show_hours = period == Order.DashboardFilterPeriod.today.name
-        show_days = period in (
-            Order.DashboardFilterPeriod.week.name,
-            Order.DashboardFilterPeriod.month.name,
-            Order.DashboardFilterPeriod.this_month.name,
-            Order.DashboardFilterPeriod.previous_month.name,
-        ) or (timezone.now() - first_order_dt).days < show_days_maximal_days_limit
-        show_months = period in (
-            Order.DashboardFilterPeriod.year.name,
-            Order.DashboardFilterPeriod.this_year.name,
-            Order.DashboardFilterPeriod.previous_year.name,
-        ) or (timezone.now() - first_order_dt).days < show_months_maximal_days_limit
-
-        if show_hours:
-            annotate = F('created_at__hour')
-        elif show_days:
-            annotate = F('created_at__date')
-        elif show_months:
-            annotate = Case(
-                # no need add leading zero
-                When(
-                    created_at__month__in=[10, 11, 12],
-                    # concat for right ordering in case of different years, for example 2022_12 and 2023_01
-                    then=Concat(
-                        F('created_at__year'), Value('.'), F('created_at__month'),
-                        output_field=models.CharField()
-                    )
-                ),
-                # need add leading zero
-                When(
-                    created_at__month__in=[i for i in range(1, 10)],  # first 9 months
-                    # concat for right ordering in case of different years, for example 2022_12 and 2023_01
-                    then=Concat(
-                        F('created_at__year'), Value('.0'), F('created_at__month'),
-                        output_field=models.CharField()
-                    )
-                )
-            )
-        else:
-            annotate = F('created_at__year')
+    def get_weekday_hour_heatmap(self) -> list[list[int]]:
+        """Get counts of orders by weekdays (rows, from Monday) and hours (columns) in one grouped query"""
+        by_weekday_hour = self.annotate(
+            weekday=ExtractIsoWeekDay('created_at'),
+            hour=ExtractHour('created_at'),
+        ).values('weekday', 'hour').annotate(num=Count('id')).order_by()
+        return to_weekday_hour_matrix(by_weekday_hour)
 
-        return self.annotate(t=annotate).values('t').annotate(num=Count('t')).order_by('t')
+    def get_time_series(
+        self,
+        granularity: str,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None
+    ) -> tuple[str, list[dict[str, Any]]]:
+        """Get counts of orders in buckets of granularity (hour, day, week or month) in [start, end) without gaps
 
-    def get_order_points_avg(self) -> models.QuerySet:
-        """Compute avg time between each pair from points of order: create time, compose time, delivery time"""
+        Not passed start is creation of first order, not passed end is now. Granularity is coarsened
+        if there are more than MAX_TIME_SERIES_BUCKETS buckets, so used granularity is returned with rows.
+        """
+        start = start or self.aggregate(first=Min('created_at'))['first']
+        end = end or timezone.now()
+        if not start:
+            return granularity, []
+        granularity = fit_granularity(start, end, granularity)
+
+        by_buckets = self.annotate(
+            bucket=Trunc('created_at', granularity, output_field=models.DateTimeField())
+        ).values('bucket').annotate(num=Count('id')).order_by()
+        counts = {timezone.make_naive(row['bucket']): row['num'] for row in by_buckets}
+        return granularity, fill_time_series(counts, start, end, granularity)
+
+    def annotate_order_points(self) -> models.QuerySet:
+        """Annotate time between each pair from points of order: create time, compose time, delivery time"""
         work_day_start = datetime.time(8, 0, tzinfo=timezone.get_current_timezone())
         return self.annotate(
             delivered_date=F('delivered_at__date'),
@@ -268,11 +492,50 @@ class OrderQuerySet(models.QuerySet):
                 When(delivered_date__gt=F('composed_date'),
                      then=F('delivered_time') - work_day_start),
             ),
-        ).aggregate(
+        )
+
+    def get_order_points_avg(self) -> dict[str, Optional[datetime.timedelta]]:
+        """Compute avg time between each pair from points of order: create time, compose time, delivery time"""
+        return self.annotate_order_points().aggregate(
+            order_to_delivery_avg_time=Avg('order_to_delivery_time'),
+            order_to_compose_avg_time=Avg('order_to_compose_time'),
+            compose_to_delivery_avg_time=Avg('compose_to_delivery_time'),
+        )
+
+    def dashboard_summary(self) -> dict[str, Any]:
+        """Compute headline numbers of dashboard by one scan of orders
+
+        Return sum and count of orders, count of unique clients, avg time between points of order
+        (see get_order_points_avg) and name of most popular delivery window.
+        """
+        windows = get_delivery_windows()
+        summary = self.annotate_order_points().aggregate(
+            orders_sum=Sum('price'),
+            orders_count=Count('id'),
+            unique_clients_count=Count('phone', distinct=True),
             order_to_delivery_avg_time=Avg('order_to_delivery_time'),
             order_to_compose_avg_time=Avg('order_to_compose_time'),
             compose_to_delivery_avg_time=Avg('compose_to_delivery_time'),
+            **{f'window_{window_id}': Count('id', filter=Q(delivery_window_id=window_id)) for window_id, _ in windows},
         )
+        summary['most_popular_window'] = pop_most_popular_window(summary, windows)
+        return summary
+
+    def get_rollup_rows(self) -> models.QuerySet:
+        """Get not cancelled orders aggregated by day, hour, bouquet and delivery window (rows of OrderRollup)"""
+        return self.exclude(status=Order.Status.cancelled).annotate_order_points().annotate(
+            day=TruncDate('created_at'),
+            hour=ExtractHour('created_at'),
+        ).values('day', 'hour', 'bouquet_id', 'delivery_window_id').annotate(
+            orders_count=Count('id'),
+            orders_sum=Sum('price'),
+            order_to_compose_total=Sum('order_to_compose_time'),
+            order_to_compose_count=Count('order_to_compose_time'),
+            compose_to_delivery_total=Sum('compose_to_delivery_time'),
+            compose_to_delivery_count=Count('compose_to_delivery_time'),
+            order_to_delivery_total=Sum('order_to_delivery_time'),
+            order_to_delivery_count=Count('order_to_delivery_time'),
+        ).order_by()
 
     def get_top_n_clients(self, n: int) -> models.QuerySet:
         """Get n top clients by sum of orders and count of orders"""
@@ -308,23 +571,12 @@ class Order(models.Model):
         previous_month = 'Прошлый месяц'
         previous_year = 'Прошлый год'
 
-    now_date = timezone.now().date()
-    dashboard_period_filters = {
-        'all': {},
-        'today': {'created_at__date': now_date},
-        'week': {'created_at__date__gt': now_date - timezone.timedelta(days=7)},
-        'month': {'created_at__date__gt': now_date - timezone.timedelta(days=31)},
-        'year': {'created_at__date__gt': now_date - timezone.timedelta(days=365)},
-        'this_month': {
-            'created_at__month': now_date.month,
-            'created_at__year': now_date.year,
-        },
-        'this_year': {'created_at__year': now_date.year},
-        'previous_month': {
-            'created_at__month': now_date.month - 1 if now_date.month != 1 else 12,
-            'created_at__year': now_date.year if now_date.month != 1 else now_date.year - 1
-        },
-        'previous_year': {'created_at__year': timezone.now().date().year - 1},
+    # next status of order in flow by status and field which is stamped by time of transition to next status
+    TRANSITIONS = {
+        Status.created: (Status.composing, None),
+        Status.composing: (Status.composed, 'composed_at'),
+        Status.composed: (Status.delivering, None),
+        Status.delivering: (Status.delivered, 'delivered_at'),
     }
 
     bouquet = models.ForeignKey(Bouquet, related_name='orders', on_delete=models.DO_NOTHING)
@@ -359,9 +611,108 @@ class Order(models.Model):
     )
     florist = models.ForeignKey(User, related_name='f_orders', on_delete=models.DO_NOTHING, null=True, blank=True)
     courier = models.ForeignKey(User, related_name='c_orders', on_delete=models.DO_NOTHING, null=True, blank=True)
+    # key of submitted order form, repeated submits of form (retries, double clicks) don't create new orders
+    idempotency_key = models.UUIDField('ключ идемпотентности', unique=True, null=True, blank=True, editable=False)
 
     objects = OrderQuerySet.as_manager()
 
+    @classmethod
+    def get_dashboard_period_range(
+        cls,
+        period: str,
+        now: Optional[datetime.datetime] = None
+    ) -> tuple[Optional[datetime.datetime], Optional[datetime.datetime]]:
+        """Get half-open range [start, end) of created_at for dashboard period
+
+        Range is computed for now (by default current time) in current time zone, days start at midnight.
+        None bound means that range is not bounded from this side.
+        """
+        today = timezone.localdate(now)
+        this_month = today.replace(day=1)
+        previous_month = (this_month - datetime.timedelta(days=1)).replace(day=1)
+        next_month = (this_month + datetime.timedelta(days=31)).replace(day=1)
+        this_year = today.replace(month=1, day=1)
+        tomorrow = today + datetime.timedelta(days=1)
+
+        date_ranges = {
+            cls.DashboardFilterPeriod.all.name: (None, None),
+            cls.DashboardFilterPeriod.today.name: (today, tomorrow),
+            cls.DashboardFilterPeriod.week.name: (today - datetime.timedelta(days=6), tomorrow),
+            cls.DashboardFilterPeriod.month.name: (today - datetime.timedelta(days=30), tomorrow),
+            cls.DashboardFilterPeriod.year.name: (today - datetime.timedelta(days=364), tomorrow),
+            cls.DashboardFilterPeriod.this_month.name: (this_month, next_month),
+            cls.DashboardFilterPeriod.this_year.name: (this_year, this_year.replace(year=this_year.year + 1)),
+            cls.DashboardFilterPeriod.previous_month.name: (previous_month, this_month),
+            cls.DashboardFilterPeriod.previous_year.name: (this_year.replace(year=this_year.year - 1), this_year),
+        }
+        return tuple(date and get_day_start(date) for date in date_ranges[period])
+
+    @classmethod
+    def get_dashboard_period_filters(
+        cls,
+        period: str,
+        now: Optional[datetime.datetime] = None,
+        field: str = 'created_at'
+    ) -> dict[str, datetime.datetime]:
+        """Get filters of created_at (or other datetime field) for dashboard period
+
+        Filters are comparisons of field itself (not extracted date, month or year), so index of field can be used.
+        """
+        start, end = cls.get_dashboard_period_range(period, now)
+        filters = {}
+        if start:
+            filters[f'{field}__gte'] = start
+        if end:
+            filters[f'{field}__lt'] = end
+        return filters
+
+    def get_order_points(self) -> dict[str, Optional[datetime.timedelta]]:
+        """Same as OrderQuerySet.annotate_order_points but computed for this order"""
+        work_day_start = datetime.time(8, 0)
+        created_at = timezone.localtime(self.created_at)
+        composed_at = self.composed_at and timezone.localtime(self.composed_at)
+        delivered_at = self.delivered_at and timezone.localtime(self.delivered_at)
+
+        def get_time_between(start: Optional[datetime.datetime], end: Optional[datetime.datetime]):
+            if not start or not end:
+                return None
+            if end.date() == start.date():
+                return end - start
+            if end.date() > start.date():
+                # next day work starts in the start of work day
+                return (
+                    datetime.datetime.combine(datetime.date.min, end.time())
+                    - datetime.datetime.combine(datetime.date.min, work_day_start)
+                )
+            return None
+
+        return {
+            'order_to_delivery': get_time_between(created_at, delivered_at),
+            'order_to_compose': get_time_between(created_at, composed_at),
+            'compose_to_delivery': get_time_between(composed_at, delivered_at),
+        }
+
+    def get_rollup_contribution(self) -> Optional[tuple[dict[str, Any], dict[str, Any]]]:
+        """Get key of OrderRollup which contains this order and values which this order adds to it
+
+        Return None if order is not in rollups (cancelled orders).
+        """
+        if self.status == self.Status.cancelled:
+            return None
+
+        created_at = timezone.localtime(self.created_at)
+        key = {
+            'day': created_at.date(),
+            'hour': created_at.hour,
+            'bouquet_id': self.bouquet_id,
+            'delivery_window_id': self.delivery_window_id,
+        }
+        values = {'orders_count': 1, 'orders_sum': Decimal(str(self.price))}
+        for point, duration in self.get_order_points().items():
+            values[f'{point}_total'] = duration or datetime.timedelta()
+            values[f'{point}_count'] = int(duration is not None)
+        return key, values
+
     def is_for_florist_statuses(self):
         return self.status in [self.Status.created, self.Status.composing]
 
@@ -371,12 +722,449 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
-        indexes = [models.Index(TruncDate("created_at"), "created_at", name="order_created_at_date_idx")]
+        indexes = [
+            models.Index(TruncDate("created_at"), "created_at", name="order_created_at_date_idx"),
+            # for ranges of dashboard periods
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            # for queues of florists and couriers (see OrderQuerySet.get_queue_page)
+            models.Index(fields=['status', 'created_at'], name='order_status_created_at_idx'),
+        ]
 
     def __str__(self):
         return f'Заказ {self.pk} ({self.created_at}), {self.bouquet} по адресу {self.delivery_address}'
 
 
+def sum_by_days(rows: Iterable[dict[str, Any]], fields: list[str]) -> dict[datetime.date, dict[str, Any]]:
+    """Sum fields of rows by day, durations are summed as microseconds and None as zero"""
+    by_days = {}
+    for row in rows:
+        day_totals = by_days.setdefault(row['day'], dict.fromkeys(fields, 0))
+        for name in fields:
+            value = row[name] or 0
+            if isinstance(value, datetime.timedelta):
+                value = value // datetime.timedelta(microseconds=1)
+            day_totals[name] += value
+    return by_days
+
+
+class OrderRollupQuerySet(models.QuerySet):
+    def compute(
+        self,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> list['OrderRollup']:
+        """Compute (without saving) rollups of days between date_from and date_to (both included) from orders
+
+        If date is None the range is not bounded from this side.
+        """
+        orders = Order.objects.created_in_days(date_from, date_to)
+
+        # totals of durations are None if there are no composed or delivered orders in rollup, so defaults are used
+        return [
+            OrderRollup(**{name: value for name, value in row.items() if value is not None})
+            for row in orders.get_rollup_rows()
+        ]
+
+    def replace(
+        self,
+        new_rollups: list['OrderRollup'],
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> int:
+        """Replace rollups of days between date_from and date_to (both included) by new_rollups
+
+        Return count of created rollups.
+        """
+        rollups = self.all()
+        if date_from:
+            rollups = rollups.filter(day__gte=date_from)
+        if date_to:
+            rollups = rollups.filter(day__lte=date_to)
+
+        with transaction.atomic():
+            rollups.delete()
+            self.bulk_create(new_rollups, batch_size=1000)
+            # rows are replaced without signals, so cached dashboard is invalidated here
+            transaction.on_commit(lambda: bump_data_version('dashboard'))
+        return len(new_rollups)
+
+    def rebuild(self, date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None) -> int:
+        """Recompute rollups of days between date_from and date_to (both included) from orders
+
+        Daily sketches of durations are recomputed too. If date is None the range is not bounded from this side.
+        Return count of created rollups.
+        """
+        OrderDailySketch.objects.rebuild(date_from, date_to)
+        return self.replace(self.compute(date_from, date_to), date_from, date_to)
+
+    def apply_delta(
+        self,
+        old_contribution: Optional[tuple[dict[str, Any], dict[str, Any]]],
+        new_contribution: Optional[tuple[dict[str, Any], dict[str, Any]]],
+    ) -> None:
+        """Move one order in rollups from old contribution to new (see Order.get_rollup_contribution)
+
+        Only affected rollups are updated, None contribution means that order is not in rollups.
+        """
+        if old_contribution == new_contribution:
+            return
+
+        if old_contribution and new_contribution and old_contribution[0] == new_contribution[0]:
+            key, new_values = new_contribution
+            old_values = old_contribution[1]
+            self._add_to_rollup(key, {name: new_values[name] - old_values[name] for name in new_values})
+            return
+
+        if old_contribution:
+            key, old_values = old_contribution
+            self._add_to_rollup(key, {name: -value for name, value in old_values.items()})
+        if new_contribution:
+            self._add_to_rollup(*new_contribution)
+
+    def _add_to_rollup(self, key: dict[str, Any], values: dict[str, Any]) -> None:
+        with transaction.atomic():
+            rollups = self.filter(**key)
+            updated = rollups.update(**{name: F(name) + value for name, value in values.items()})
+            if not updated:
+                self.create(**key, **values)
+            # rollups without orders are useless
+            rollups.filter(orders_count=0).delete()
+
+    def get_mismatched_days(
+        self,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> list[datetime.date]:
+        """Compare rollups with aggregates of orders by days between date_from and date_to (both included)
+
+        Return days where rollups differ from orders.
+        """
+        orders = Order.objects.created_in_days(date_from, date_to)
+        rollups = self.all()
+        if date_from:
+            rollups = rollups.filter(day__gte=date_from)
+        if date_to:
+            rollups = rollups.filter(day__lte=date_to)
+
+        aggregated_fields = [
+            field.name
+            for field in OrderRollup._meta.get_fields()
+            if field.name.endswith(('_count', '_sum', '_total'))
+        ]
+        orders_by_days = sum_by_days(orders.get_rollup_rows(), aggregated_fields)
+        rollups_by_days = sum_by_days(rollups.values('day', *aggregated_fields), aggregated_fields)
+        return sorted(
+            day
+            for day in orders_by_days.keys() | rollups_by_days.keys()
+            if orders_by_days.get(day) != rollups_by_days.get(day)
+        )
+
+    def dashboard_summary(self) -> dict[str, Any]:
+        """Same as OrderQuerySet.dashboard_summary but computed by rollups and without count of unique clients"""
+        points = ORDER_POINTS
+        windows = get_delivery_windows()
+        # aliases of aggregates can't be equal to names of fields
+        aggregated = self.aggregate(
+            all_orders_sum=Sum('orders_sum'),
+            all_orders_count=Coalesce(Sum('orders_count'), 0),
+            **{
+                f'all_{point}_{suffix}': Sum(f'{point}_{suffix}')
+                for point in points
+                for suffix in ('total', 'count')
+            },
+            **{
+                f'window_{window_id}': Sum('orders_count', filter=Q(delivery_window_id=window_id))
+                for window_id, _ in windows
+            },
+        )
+        summary = {
+            'orders_sum': aggregated.pop('all_orders_sum'),
+            'orders_count': aggregated.pop('all_orders_count'),
+        }
+        for point in points:
+            total = aggregated.pop(f'all_{point}_total')
+            count = aggregated.pop(f'all_{point}_count')
+            summary[f'{point}_avg_time'] = total / count if count else None
+        summary['most_popular_window'] = pop_most_popular_window(aggregated, windows)
+        return summary
+
+    def get_by_hours_distribution(self) -> list[dict[str, Any]]:
+        """Same as OrderQuerySet.get_by_hours_distribution but computed by rollups"""
+        by_hours_distribution = self.values('hour').annotate(num=Sum('orders_count')).order_by('hour')
+        return to_percent_distribution(by_hours_distribution)
+
+    def get_weekday_hour_heatmap(self) -> list[list[int]]:
+        """Same as OrderQuerySet.get_weekday_hour_heatmap but computed by rollups"""
+        by_weekday_hour = self.annotate(weekday=ExtractIsoWeekDay('day')).values('weekday', 'hour').annotate(
+            num=Sum('orders_count')
+        ).order_by()
+        return to_weekday_hour_matrix(by_weekday_hour)
+
+    def get_time_series(
+        self,
+        granularity: str,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None
+    ) -> tuple[str, list[dict[str, Any]]]:
+        """Same as OrderQuerySet.get_time_series but computed by rollups"""
+        first_day = None if start else self.aggregate(first=Min('day'))['first']
+        start = start or (first_day and get_day_start(first_day))
+        end = end or timezone.now()
+        if not start:
+            return granularity, []
+        granularity = fit_granularity(start, end, granularity)
+
+        if granularity == 'hour':
+            by_buckets = self.values('day', 'hour').annotate(num=Sum('orders_count')).order_by()
+            counts = {
+                datetime.datetime.combine(row['day'], datetime.time(row['hour'])): row['num']
+                for row in by_buckets
+            }
+        else:
+            by_buckets = self.annotate(
+                bucket=Trunc('day', granularity, output_field=models.DateField())
+            ).values('bucket').annotate(num=Sum('orders_count')).order_by()
+            counts = {
+                datetime.datetime.combine(row['bucket'], datetime.time.min): row['num']
+                for row in by_buckets
+            }
+        return granularity, fill_time_series(counts, start, end, granularity)
+
+    def get_top_n_bouquets(self, n: int) -> models.QuerySet:
+        """Same as OrderQuerySet.get_top_n_bouquets but computed by rollups"""
+        return self.values('bouquet__name').annotate(orders_cnt=Sum('orders_count')).order_by('-orders_cnt')[:n]
+
+
+class OrderRollup(models.Model):
+    """Not cancelled orders pre-aggregated by day, hour of creation, bouquet and delivery window.
+
+    Dashboard reads rollups instead of orders, so cost of dashboard depends on count of days, not orders.
+    Rollups are updated by deltas on every save of order (see flowerapp.signals)
+    and can be recomputed from orders by OrderRollup.objects.rebuild.
+    """
+    day = models.DateField('день создания заказов', db_index=True)
+    hour = models.PositiveSmallIntegerField('час создания заказов', validators=[MaxValueValidator(23)])
+    bouquet = models.ForeignKey(Bouquet, related_name='rollups', verbose_name='букет', on_delete=models.CASCADE)
+    delivery_window = models.ForeignKey(
+        DeliveryWindow,
+        related_name='rollups',
+        verbose_name='окно доставки',
+        on_delete=models.CASCADE,
+        null=True,  # null if ASAP
+        blank=True
+    )
+    orders_count = models.PositiveIntegerField('количество заказов', default=0)
+    orders_sum = models.DecimalField('сумма заказов', max_digits=12, decimal_places=2, default=0)
+    # totals and counts of durations for compute avg time between points of order
+    order_to_compose_total = models.DurationField('суммарное время от заказа до сбора', default=datetime.timedelta)
+    order_to_compose_count = models.PositiveIntegerField('количество собранных заказов', default=0)
+    compose_to_delivery_total = models.DurationField(
+        'суммарное время от сбора до доставки',
+        default=datetime.timedelta
+    )
+    compose_to_delivery_count = models.PositiveIntegerField('количество доставленных собранных заказов', default=0)
+    order_to_delivery_total = models.DurationField('суммарное время от заказа до доставки', default=datetime.timedelta)
+    order_to_delivery_count = models.PositiveIntegerField('количество доставленных заказов', default=0)
+
+    objects = OrderRollupQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'агрегат заказов'
+        verbose_name_plural = 'агрегаты заказов'
+        unique_together = [['day', 'hour', 'bouquet', 'delivery_window']]
+
+    def __str__(self):
+        return f'Заказы {self.day} {self.hour}:00, {self.bouquet}, окно {self.delivery_window}'
+
+    @staticmethod
+    def get_dashboard_period_filters(period: str, now: Optional[datetime.datetime] = None) -> dict[str, Any]:
+        """Get filters of rollups which are equal to Order.get_dashboard_period_filters"""
+        start, end = Order.get_dashboard_period_range(period, now)
+        filters = {}
+        # bounds of periods are midnights, so days of rollups are in range if their midnights are in range
+        if start:
+            filters['day__gte'] = timezone.localdate(start)
+        if end:
+            filters['day__lt'] = timezone.localdate(end)
+        return filters
+
+
+class OrderDailySketchQuerySet(models.QuerySet):
+    def compute(
+        self,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> list['OrderDailySketch']:
+        """Compute (without saving) sketches of days between date_from and date_to (both included) from orders"""
+        orders = Order.objects.exclude(status=Order.Status.cancelled).created_in_days(date_from, date_to)
+        rows = orders.annotate_order_points().annotate(day=TruncDate('created_at')).values_list(
+            'day', 'bouquet_id', 'phone', *[f'{point}_time' for point in ORDER_POINTS]
+        ).order_by()
+
+        sketches = {}
+        for day, bouquet_id, phone, *durations in rows.iterator(chunk_size=2000):
+            durations_sketches, clients_sketch = sketches.setdefault(
+                (day, bouquet_id),
+                ({point: DurationSketch() for point in ORDER_POINTS}, ClientsSketch())
+            )
+            for point, duration in zip(ORDER_POINTS, durations):
+                if duration is not None:
+                    durations_sketches[point].add(duration)
+            clients_sketch.add(str(phone))
+
+        return [
+            OrderDailySketch(
+                day=day,
+                bouquet_id=bouquet_id,
+                durations={point: sketch.to_json() for point, sketch in durations_sketches.items()},
+                clients=clients_sketch.to_json(),
+            )
+            for (day, bouquet_id), (durations_sketches, clients_sketch) in sketches.items()
+        ]
+
+    def replace(
+        self,
+        new_sketches: list['OrderDailySketch'],
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> int:
+        """Replace sketches of days between date_from and date_to (both included) by new_sketches"""
+        sketches = self.all()
+        if date_from:
+            sketches = sketches.filter(day__gte=date_from)
+        if date_to:
+            sketches = sketches.filter(day__lte=date_to)
+
+        with transaction.atomic():
+            sketches.delete()
+            self.bulk_create(new_sketches, batch_size=1000)
+            # rows are replaced without signals, so cached dashboard is invalidated here
+            transaction.on_commit(lambda: bump_data_version('dashboard'))
+        return len(new_sketches)
+
+    def rebuild(self, date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None) -> int:
+        """Recompute sketches of days between date_from and date_to (both included) from orders"""
+        return self.replace(self.compute(date_from, date_to), date_from, date_to)
+
+    def apply_delta(
+        self,
+        old_contribution: Optional[tuple[dict[str, Any], dict[str, Any]]],
+        new_contribution: Optional[tuple[dict[str, Any], dict[str, Any]]],
+        old_phone: Optional[str] = None,
+        new_phone: Optional[str] = None,
+    ) -> None:
+        """Move durations and client of one order from old contribution to new
+
+        Contributions are the same as in OrderRollupQuerySet.apply_delta. Clients can't be removed from sketch,
+        so clients sketch of old contribution is recomputed from orders (they should be already saved).
+        """
+        if old_contribution == new_contribution and old_phone == new_phone:
+            return
+
+        with transaction.atomic():
+            for contribution, sign in ((old_contribution, -1), (new_contribution, 1)):
+                if not contribution:
+                    continue
+                key, values = contribution
+                daily_sketch, _ = self.select_for_update().get_or_create(day=key['day'], bouquet_id=key['bouquet_id'])
+                durations = daily_sketch.get_durations_sketches()
+                for point, sketch in durations.items():
+                    if values[f'{point}_count']:
+                        sketch.add(values[f'{point}_total'], sign)
+
+                if sign > 0:
+                    clients = daily_sketch.get_clients_sketch()
+                    clients.add(str(new_phone))
+                else:
+                    clients = ClientsSketch()
+                    phones = Order.objects.exclude(status=Order.Status.cancelled).filter(
+                        bouquet_id=key['bouquet_id']
+                    ).created_in_days(key['day'], key['day']).values_list('phone', flat=True)
+                    for phone in phones:
+                        clients.add(str(phone))
+
+                # sketch without clients has no orders
+                if clients.is_empty:
+                    daily_sketch.delete()
+                    continue
+                daily_sketch.durations = {point: sketch.to_json() for point, sketch in durations.items()}
+                daily_sketch.clients = clients.to_json()
+                daily_sketch.save(update_fields=['durations', 'clients'])
+
+    def get_mismatched_days(
+        self,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+    ) -> list[datetime.date]:
+        """Compare counts of durations in sketches with rollups by days, return days where they differ"""
+        sketches = self.all()
+        rollups = OrderRollup.objects.all()
+        if date_from:
+            sketches = sketches.filter(day__gte=date_from)
+            rollups = rollups.filter(day__gte=date_from)
+        if date_to:
+            sketches = sketches.filter(day__lte=date_to)
+            rollups = rollups.filter(day__lte=date_to)
+
+        counts_fields = [f'{point}_count' for point in ORDER_POINTS]
+        sketches_rows = (
+            {
+                'day': daily_sketch.day,
+                **{f'{point}_count': sketch.count for point, sketch in daily_sketch.get_durations_sketches().items()},
+            }
+            for daily_sketch in sketches.iterator(chunk_size=2000)
+        )
+        sketches_by_days = sum_by_days(sketches_rows, counts_fields)
+        rollups_by_days = sum_by_days(rollups.values('day', *counts_fields), counts_fields)
+        # days without durations have no sketches
+        empty_day = dict.fromkeys(counts_fields, 0)
+        return sorted(
+            day
+            for day in sketches_by_days.keys() | rollups_by_days.keys()
+            if sketches_by_days.get(day, empty_day) != rollups_by_days.get(day, empty_day)
+        )
+
+    def get_merged_sketches(self) -> tuple[dict[str, DurationSketch], ClientsSketch]:
+        """Merge sketches of all days into one sketch for every pair of points of order (see ORDER_POINTS)
+        and one sketch of clients
+        """
+        durations_sketches = {point: DurationSketch() for point in ORDER_POINTS}
+        clients_sketch = ClientsSketch()
+        for durations, clients in self.values_list('durations', 'clients').iterator(chunk_size=2000):
+            for point, sketch in durations_sketches.items():
+                sketch.merge(DurationSketch.from_json(durations.get(point)))
+            clients_sketch.merge(ClientsSketch.from_json(clients))
+        return durations_sketches, clients_sketch
+
+
+class OrderDailySketch(models.Model):
+    """Sketches of durations between points and of clients of not cancelled orders by day of creation and bouquet
+
+    Sketches give approximate percentiles and histograms of durations and count of unique clients
+    (see flowerapp.sketches) without loading every order. They are maintained together with rollups (see OrderRollup).
+    """
+    day = models.DateField('день создания заказов', db_index=True)
+    bouquet = models.ForeignKey(Bouquet, related_name='daily_sketches', verbose_name='букет', on_delete=models.CASCADE)
+    durations = models.JSONField('скетчи длительностей', default=dict)
+    clients = models.JSONField('скетч клиентов', default=dict)
+
+    objects = OrderDailySketchQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'скетч заказов за день'
+        verbose_name_plural = 'скетчи заказов за день'
+        unique_together = [['day', 'bouquet']]
+
+    def __str__(self):
+        return f'Скетч заказов {self.day}, {self.bouquet}'
+
+    def get_durations_sketches(self) -> dict[str, DurationSketch]:
+        return {point: DurationSketch.from_json(self.durations.get(point)) for point in ORDER_POINTS}
+
+    def get_clients_sketch(self) -> ClientsSketch:
+        return ClientsSketch.from_json(self.clients)
+
+
 class Consultation(models.Model):
     class Status(models.TextChoices):
         created = 'создана'
@@ -400,7 +1188,11 @@ class Consultation(models.Model):
     class Meta:
         verbose_name = 'консультация'
         verbose_name_plural = 'консультации'
-        indexes = [models.Index(TruncDate("created_at"), "created_at", name="cons_created_at_date_idx")]
+        indexes = [
+            models.Index(TruncDate("created_at"), "created_at", name="cons_created_at_date_idx"),
+            # for ranges of dashboard periods
+            models.Index(fields=['created_at'], name='cons_created_at_idx'),
+        ]
 
     def __str__(self):
         return f'Консультация {self.pk} ({self.created_at}), {self.phone} ({self.client_name})'
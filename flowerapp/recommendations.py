@@ -0,0 +1,205 @@
+import bisect
+import datetime
+import heapq
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .caching import LocalVersionedValue, get_data_version
+from .models import Bouquet
+from .models import FlowerShop
+from .models import FlowerShopCatalogItem
+from .models import OrderRollup
+
+
+def parse_price(price: Optional[str]) -> Optional[Decimal]:
+    """Parse price from quiz, None if price is not passed or it is not a number"""
+    if not price:
+        return None
+    try:
+        price = Decimal(price)
+    except InvalidOperation:
+        return None
+    return price if price.is_finite() else None
+
+
+# weights of features in score of bouquet, bouquet in budget is always higher than bouquet out of budget
+RECOMMENDATION_WEIGHTS = {
+    'in_budget': 4.0,
+    'event': 1.0,
+    'budget_fit': 0.5,
+    'availability': 0.5,
+    'sales': 0.5,
+}
+RECENT_SALES_DAYS = 30
+# max count of bouquets in budget (and of bouquets of event in budget) which are scored,
+# they are bouquets with prices closest to middle of budget (bound of half open budget, max price without budget)
+RECOMMENDATION_CANDIDATES = 100
+
+
+def get_closest_positions(
+    prices: list[Decimal],
+    start: int,
+    end: int,
+    anchor: Optional[Decimal],
+    count: int
+) -> range:
+    """Get range of up to count positions between start and end of sorted prices with prices closest to anchor
+
+    Without anchor the most expensive positions are returned.
+    """
+    if end - start <= count:
+        return range(start, end)
+    if anchor is None:
+        return range(end - count, end)
+    left = right = bisect.bisect_left(prices, anchor, start, end)
+    while right - left < count:
+        if right >= end or (left > start and anchor - prices[left - 1] <= prices[right] - anchor):
+            left -= 1
+        else:
+            right += 1
+    return range(left, right)
+
+
+class RecommendationIndex:
+    """Features of bouquets to recommend bouquets without database
+
+    Bouquets are sorted by price, and bouquets of every event are sorted by price too. So candidates are found
+    by binary search of budget: bouquets in budget closest to its middle and bouquets of event in budget
+    (not more than RECOMMENDATION_CANDIDATES of each), and bouquets next to budget if there are less than k
+    candidates. Only candidates are scored, so recommendation costs O(log N + RECOMMENDATION_CANDIDATES + k)
+    for N bouquets. Bouquets are loaded with their items, so result page doesn't query them too.
+    """
+
+    def __init__(
+        self,
+        bouquets: list[Bouquet],
+        availability: Optional[dict[int, float]] = None,
+        sales: Optional[dict[int, int]] = None
+    ):
+        """availability is share of shops where bouquet is available, sales are counts of recent orders of bouquets"""
+        availability = availability or {}
+        sales = sales or {}
+        max_sales = max(sales.values(), default=0) or 1
+
+        # bouquets with equal prices are ordered by id, so recommendation doesn't depend on order of loading
+        self.bouquets = sorted(bouquets, key=lambda bouquet: (bouquet.price, bouquet.id))
+        self.prices = [bouquet.price for bouquet in self.bouquets]
+        self.availability = [availability.get(bouquet.id, 0.0) for bouquet in self.bouquets]
+        self.sales = [sales.get(bouquet.id, 0) / max_sales for bouquet in self.bouquets]
+        # positions of bouquets of every event, they are sorted by price too
+        self.positions_by_events = {}
+        for position, bouquet in enumerate(self.bouquets):
+            for event in bouquet.events.all():
+                self.positions_by_events.setdefault(event.id, []).append(position)
+        self.prices_by_events = {
+            event_id: [self.prices[position] for position in positions]
+            for event_id, positions in self.positions_by_events.items()
+        }
+
+    @classmethod
+    def build(cls) -> 'RecommendationIndex':
+        bouquets = list(Bouquet.objects.prefetch_related('events', 'items', 'items__item'))
+
+        shops_count = FlowerShop.objects.count() or 1
+        availability = {
+            row['bouquet']: row['shops_count'] / shops_count
+            for row in FlowerShopCatalogItem.objects.filter(availability=True).values('bouquet').annotate(
+                shops_count=Count('id')
+            ).order_by()
+        }
+
+        recent_days_start = timezone.localdate() - datetime.timedelta(days=RECENT_SALES_DAYS)
+        sales = dict(
+            OrderRollup.objects.filter(day__gte=recent_days_start).values_list('bouquet').annotate(
+                sales=Sum('orders_count')
+            ).order_by()
+        )
+        return cls(bouquets, availability, sales)
+
+    def get_budget_fit(self, price: Decimal, price_from: Optional[Decimal], price_to: Optional[Decimal]) -> float:
+        """Get closeness of price to middle of budget (to bound of half open budget) from 0 to 1"""
+        if price_from is None and price_to is None:
+            return 0.0
+        if price_from is None or price_to is None:
+            bound = price_from if price_to is None else price_to
+            max_distance = max(abs(self.prices[0] - bound), abs(self.prices[-1] - bound)) or 1
+            return float(1 - abs(price - bound) / max_distance)
+        middle, half_width = (price_from + price_to) / 2, abs(price_to - price_from) / 2 or 1
+        return float(max(0, 1 - abs(price - middle) / half_width))
+
+    def get_candidates(
+        self,
+        positions: Optional[list[int]],
+        prices: list[Decimal],
+        price_from: Optional[Decimal],
+        price_to: Optional[Decimal],
+        k: int
+    ) -> list[int]:
+        """Get positions of bouquets (all if positions is None) which are candidates for budget"""
+        start = bisect.bisect_left(prices, price_from) if price_from is not None else 0
+        end = max(bisect.bisect_right(prices, price_to), start) if price_to is not None else len(prices)
+        if price_from is not None and price_to is not None:
+            anchor = (price_from + price_to) / 2
+        else:
+            anchor = price_from if price_to is None else price_to
+        candidates = list(get_closest_positions(prices, start, end, anchor, RECOMMENDATION_CANDIDATES))
+        if len(candidates) < k:
+            # bouquets out of budget which are the closest to it
+            candidates += range(max(start - k, 0), start)
+            candidates += range(end, min(end + k, len(prices)))
+        return candidates if positions is None else [positions[candidate] for candidate in candidates]
+
+    def recommend(
+        self,
+        event: Optional[str],
+        price_from: Optional[str],
+        price_to: Optional[str],
+        k: int = 1
+    ) -> list[Bouquet]:
+        """Get k bouquets with highest scores, sorted by score
+
+        Score is weighted sum of bouquet in budget, event match, closeness of price to middle of budget,
+        share of shops where bouquet is available and recent sales (see RECOMMENDATION_WEIGHTS).
+        """
+        if not self.bouquets:
+            return []
+        event_id = int(event) if event and event.isdigit() else None
+        event_positions = set(self.positions_by_events.get(event_id, []))
+        price_from, price_to = parse_price(price_from), parse_price(price_to)
+
+        candidates = set(self.get_candidates(None, self.prices, price_from, price_to, k))
+        if event_positions:
+            candidates.update(self.get_candidates(
+                self.positions_by_events[event_id], self.prices_by_events[event_id], price_from, price_to, k
+            ))
+
+        weights = RECOMMENDATION_WEIGHTS
+        scores = {}
+        for position in candidates:
+            price = self.prices[position]
+            in_budget = (price_from is None or price >= price_from) and (price_to is None or price <= price_to)
+            scores[position] = (
+                weights['in_budget'] * in_budget
+                + weights['event'] * (position in event_positions)
+                + weights['budget_fit'] * self.get_budget_fit(price, price_from, price_to)
+                + weights['availability'] * self.availability[position]
+                + weights['sales'] * self.sales[position]
+            )
+        # more expensive bouquet wins if scores are equal
+        best_positions = heapq.nlargest(k, scores, key=lambda position: (scores[position], position))
+        return [self.bouquets[position] for position in best_positions]
+
+
+# catalog version is bumped by changes of bouquets, events, items of bouquets and availability in shops
+# (see flowerapp.signals), recent sales are updated once a day
+_recommendation_index = LocalVersionedValue(
+    RecommendationIndex.build,
+    lambda: (get_data_version('catalog'), timezone.localdate())
+)
+
+
+def get_recommendation_index() -> RecommendationIndex:
+    return _recommendation_index.get()
@@ -0,0 +1,94 @@
+from typing import Iterable
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Bouquet
+from .stemmer import get_search_text, stem, tokenize
+
+SEARCH_TABLE = 'flowerapp_bouquet_search'
+# weights of columns name, description and items in rank of found bouquet
+SEARCH_COLUMNS_WEIGHTS = (10.0, 1.0, 5.0)
+SEARCH_RESULTS_LIMIT = 30
+
+_search_index_availability = {}
+
+
+def is_search_index_available() -> bool:
+    """Search index is FTS5 table of SQLite, it is created by migration only on SQLite with FTS5
+
+    Availability is checked once for database, tables are not changed without migrations.
+    """
+    database = connection.settings_dict['NAME']
+    if database not in _search_index_availability:
+        _search_index_availability[database] = (
+            connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+        )
+    return _search_index_availability[database]
+
+
+def index_bouquets(bouquets_ids: Iterable[int]) -> None:
+    """Replace rows of search index for bouquets, rows of deleted bouquets are removed"""
+    bouquets_ids = list(bouquets_ids)
+    if not bouquets_ids or not is_search_index_available():
+        return
+
+    bouquets = Bouquet.objects.filter(id__in=bouquets_ids).prefetch_related('items__item')
+    rows = [
+        (
+            bouquet.id,
+            get_search_text([bouquet.name]),
+            get_search_text([bouquet.description]),
+            get_search_text(bouquet_item.item.name for bouquet_item in bouquet.items.all()),
+        )
+        for bouquet in bouquets
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(bouquets_ids))})',
+            bouquets_ids
+        )
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, items) VALUES (%s, %s, %s, %s)',
+            rows
+        )
+
+
+def rebuild_search_index() -> None:
+    if not is_search_index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+    index_bouquets(Bouquet.objects.values_list('id', flat=True))
+
+
+def search_bouquets(query: str, limit: int = SEARCH_RESULTS_LIMIT) -> list[Bouquet]:
+    """Find bouquets which have all words of query (or words which start with them) in name, description or items
+
+    Bouquets are ranked by BM25 with weights of columns SEARCH_COLUMNS_WEIGHTS.
+    Without search index (not SQLite database) bouquets are found by icontains and ordered by name.
+    """
+    words = tokenize(query)
+    if not words:
+        return []
+
+    if not is_search_index_available():
+        bouquets = Bouquet.objects.all()
+        for word in words:
+            bouquets = bouquets.filter(
+                Q(name__icontains=word) | Q(description__icontains=word) | Q(items__item__name__icontains=word)
+            )
+        return list(bouquets.distinct().order_by('name')[:limit])
+
+    # every stem is a phrase with prefix search, phrases are joined by AND
+    match = ' '.join(f'"{stem(word)}"*' for word in words)
+    rank = f'bm25({SEARCH_TABLE}, {", ".join(map(str, SEARCH_COLUMNS_WEIGHTS))})'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY {rank} LIMIT %s',
+            [match, limit]
+        )
+        bouquets_ids = [row[0] for row in cursor.fetchall()]
+
+    bouquets = Bouquet.objects.in_bulk(bouquets_ids)
+    return [bouquets[bouquet_id] for bouquet_id in bouquets_ids if bouquet_id in bouquets]
@@ -0,0 +1,202 @@
+import contextlib
+import threading
+from typing import Any, Optional
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_data_version
+from .models import Bouquet
+from .models import BouquetItem
+from .models import BouquetItemsInBouquet
+from .models import Consultation
+from .models import DeliveryWindow
+from .models import Event
+from .models import FlowerShop
+from .models import FlowerShopCatalogItem
+from .models import Order
+from .models import OrderDailySketch
+from .models import OrderRollup
+from .models import order_status_changed
+from .search import index_bouquets
+from .thumbnails import generate_thumbnails, refresh_bouquets_tiles
+
+# fields of order which affect rollups
+ORDER_ROLLUP_FIELDS = [
+    Order._meta.get_field(name).attname
+    for name in ('status', 'created_at', 'composed_at', 'delivered_at', 'price', 'bouquet', 'delivery_window', 'phone')
+]
+
+_rollups_state = threading.local()
+
+
+@contextlib.contextmanager
+def rollups_maintenance_suspended():
+    """Disable rollups maintenance by order signals, for bulk operations which rebuild rollups by themselves."""
+    _rollups_state.suspended = True
+    try:
+        yield
+    finally:
+        _rollups_state.suspended = False
+
+
+def is_rollups_maintenance_suspended() -> bool:
+    return getattr(_rollups_state, 'suspended', False)
+
+
+def get_order_rollup_state(order: Order) -> Optional[dict[str, Any]]:
+    """Get values of order fields which affect rollups, None if some of them are deferred"""
+    if any(attname not in order.__dict__ for attname in ORDER_ROLLUP_FIELDS):
+        return None
+    return {attname: order.__dict__[attname] for attname in ORDER_ROLLUP_FIELDS}
+
+
+def get_state_rollup_contribution(state: dict[str, Any]):
+    return Order(**state).get_rollup_contribution()
+
+
+def apply_order_state_delta(old_state: Optional[dict[str, Any]], new_state: Optional[dict[str, Any]]) -> None:
+    """Move order in rollups and daily sketches from old state to new, None state means that order is not in database"""
+    old_contribution = old_state and get_state_rollup_contribution(old_state)
+    new_contribution = new_state and get_state_rollup_contribution(new_state)
+    OrderRollup.objects.apply_delta(old_contribution, new_contribution)
+    OrderDailySketch.objects.apply_delta(
+        old_contribution,
+        new_contribution,
+        old_state and old_state['phone'],
+        new_state and new_state['phone'],
+    )
+
+
+@receiver(post_init, sender=Order)
+def remember_order_rollup_state(sender, instance: Order, **kwargs):
+    # state of order in database, it is needed for compute delta of rollups on save
+    instance._rollup_state = get_order_rollup_state(instance)
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_delete, sender=Order)
+def load_order_rollup_state(sender, instance: Order, **kwargs):
+    # order was loaded with deferred fields, so its state in database is loaded for delta of rollups
+    if instance._rollup_state is None and not instance._state.adding:
+        stored_order = Order.objects.filter(pk=instance.pk).first()
+        instance._rollup_state = stored_order and stored_order._rollup_state
+
+
+@receiver(post_save, sender=Order)
+def apply_order_rollup_delta(sender, instance: Order, created: bool, update_fields=None, **kwargs):
+    old_state = None if created else instance._rollup_state
+    new_state = get_order_rollup_state(instance)
+    if old_state:
+        # only update_fields or not deferred fields were saved, others are in database as before
+        if update_fields:
+            saved_attnames = {Order._meta.get_field(name).attname for name in update_fields}
+        else:
+            saved_attnames = instance.__dict__.keys()
+        new_state = {
+            attname: getattr(instance, attname) if attname in saved_attnames else value
+            for attname, value in old_state.items()
+        }
+    instance._rollup_state = new_state
+
+    # order without state was not in database and it is saved with deferred fields
+    if is_rollups_maintenance_suspended() or not new_state:
+        return
+    apply_order_state_delta(old_state, new_state)
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_rollups(sender, instance: Order, **kwargs):
+    # order without state was not in database
+    if is_rollups_maintenance_suspended() or not instance._rollup_state:
+        return
+
+    apply_order_state_delta(instance._rollup_state, None)
+
+
+@receiver(order_status_changed, sender=Order)
+def apply_changed_order_rollup_delta(sender, order: Order, old_status: str, **kwargs):
+    if is_rollups_maintenance_suspended():
+        return
+
+    # order is changed by UPDATE (see OrderQuerySet.transition) of status, time of transition and fields
+    # which don't affect rollups, so before UPDATE it was the same order in old status without time of transition
+    new_state = get_order_rollup_state(order)
+    old_state = {**new_state, 'status': old_status}
+    _, stamp_field = Order.TRANSITIONS[old_status]
+    if stamp_field:
+        old_state[Order._meta.get_field(stamp_field).attname] = None
+    apply_order_state_delta(old_state, new_state)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(order_status_changed, sender=Order)
+@receiver(post_save, sender=Consultation)
+@receiver(post_delete, sender=Consultation)
+@receiver(post_save, sender=Bouquet)
+@receiver(post_delete, sender=Bouquet)
+@receiver(post_save, sender=DeliveryWindow)
+@receiver(post_delete, sender=DeliveryWindow)
+def invalidate_dashboard(sender, **kwargs):
+    # after commit, otherwise dashboard can be cached by new version with not committed data
+    transaction.on_commit(lambda: bump_data_version('dashboard'))
+
+
+@receiver(post_save, sender=DeliveryWindow)
+@receiver(post_delete, sender=DeliveryWindow)
+def invalidate_delivery_windows(sender, **kwargs):
+    # choices of order form and windows of dashboard are read by flowerapp.models.get_delivery_windows
+    transaction.on_commit(lambda: bump_data_version('delivery_windows'))
+
+
+@receiver(post_save, sender=Bouquet)
+@receiver(post_delete, sender=Bouquet)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=BouquetItem)
+@receiver(post_delete, sender=BouquetItem)
+@receiver(post_save, sender=BouquetItemsInBouquet)
+@receiver(post_delete, sender=BouquetItemsInBouquet)
+@receiver(post_save, sender=FlowerShop)
+@receiver(post_delete, sender=FlowerShop)
+@receiver(post_save, sender=FlowerShopCatalogItem)
+@receiver(post_delete, sender=FlowerShopCatalogItem)
+@receiver(m2m_changed, sender=Bouquet.events.through)
+def invalidate_catalog(sender, **kwargs):
+    # indexes of catalog in all processes are rebuilt on next use (see flowerapp.recommendations)
+    transaction.on_commit(lambda: bump_data_version('catalog'))
+
+
+@receiver(post_save, sender=Bouquet)
+@receiver(post_delete, sender=Bouquet)
+def index_bouquet_for_search(sender, instance: Bouquet, **kwargs):
+    index_bouquets([instance.id])
+
+
+@receiver(post_save, sender=BouquetItemsInBouquet)
+@receiver(post_delete, sender=BouquetItemsInBouquet)
+def index_bouquet_of_item_for_search(sender, instance: BouquetItemsInBouquet, **kwargs):
+    index_bouquets([instance.bouquet_id])
+
+
+@receiver(post_save, sender=BouquetItem)
+def index_bouquets_with_item_for_search(sender, instance: BouquetItem, created: bool, **kwargs):
+    # item of bouquets was renamed, on delete of item its relations with bouquets are deleted with signals
+    if not created:
+        index_bouquets(instance.bouquet_relations.values_list('bouquet_id', flat=True))
+
+
+def generate_tiles_thumbnails(photo_name: str) -> None:
+    # tiles of bouquets could be cached with original photo before thumbnails are generated
+    if generate_thumbnails(photo_name):
+        refresh_bouquets_tiles([photo_name])
+
+
+@receiver(post_save, sender=Bouquet)
+def generate_bouquet_thumbnails(sender, instance: Bouquet, **kwargs):
+    # after commit, because photo is saved to storage before bouquet and it is not removed on rollback anyway
+    if instance.photo and instance.photo.storage.exists(instance.photo.name):
+        photo_name = instance.photo.name
+        transaction.on_commit(lambda: generate_tiles_thumbnails(photo_name))
@@ -0,0 +1,36 @@
+import re
+from typing import Iterable
+
+# endings of Russian nouns, adjectives and participles, longest first
+RUSSIAN_ENDINGS = sorted(
+    [
+        'иями', 'ями', 'ами', 'иях', 'ием', 'ией', 'иям', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя',
+        'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем', 'ах', 'ях', 'ам', 'ям', 'ов', 'ев', 'ию',
+        'ью', 'ия', 'ья', 'ую', 'юю', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+    ],
+    key=len,
+    reverse=True,
+)
+MIN_STEM_LENGTH = 3
+
+
+def stem(word: str) -> str:
+    """Light Russian stemmer: cut longest inflectional ending if at least MIN_STEM_LENGTH letters remain
+
+    It is not a morphological analyzer, so "роза", "розы" and "розами" have equal stems,
+    but "свадьба" and "свадебный" have not.
+    """
+    word = word.lower().replace('ё', 'е')
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r'\w+', text.lower())
+
+
+def get_search_text(texts: Iterable[str]) -> str:
+    """Get stems of words of texts joined by spaces, they are stored in search index instead of texts"""
+    return ' '.join(stem(word) for text in texts for word in tokenize(text))
@@ -0,0 +1,35 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.db.models.fields.files import FieldFile
+
+from flowerapp.thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_WIDTHS, get_thumbnail_name, has_thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(photo: FieldFile, extension: str = 'jpg') -> str:
+    """Get srcset of thumbnails of photo in format: photo_320w.jpg 320w, photo_640w.jpg 640w, ..."""
+    return ', '.join(
+        f'{default_storage.url(get_thumbnail_name(photo.name, width, extension))} {width}w'
+        for width in THUMBNAIL_WIDTHS
+    )
+
+
+@register.inclusion_tag('photo_picture.html')
+def photo_picture(photo: FieldFile, sizes: str, alt: str = '', css_class: str = '') -> dict:
+    """Render picture with thumbnails of photo in all formats, original photo if there are no thumbnails yet
+
+    sizes is width of picture on page for browser to choose thumbnail, for example "(max-width: 600px) 100vw, 400px".
+    """
+    thumbnails_exist = bool(photo) and has_thumbnails(photo.name)
+    return {
+        'photo': photo,
+        'sizes': sizes,
+        'alt': alt,
+        'css_class': css_class,
+        'sources': [
+            {'type': f'image/{image_format.lower()}', 'srcset': srcset(photo, extension)}
+            for extension, image_format in THUMBNAIL_FORMATS.items()
+        ] if thumbnails_exist else [],
+    }
@@ -1,3 +1,766 @@
-from django.test import TestCase
+import contextlib
+import datetime
+import io
+import json
+import re
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import Sum
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .caching import get_data_version
+from .exports import ORDER_EXPORT_FIELDS
+from .facets import FacetIndex
+from .forms import OrderForm
+from .models import Bouquet
+from .models import BouquetItem
+from .models import BouquetItemsInBouquet
+from .models import Consultation
+from .models import DeliveryWindow
+from .models import Event
+from .models import FlowerShop
+from .models import FlowerShopCatalogItem
+from .models import Order
+from .models import OrderDailySketch
+from .models import OrderRollup
+from .models import get_day_start
+from .recommendations import RecommendationIndex
+from .stemmer import stem
+from .thumbnails import THUMBNAIL_WIDTHS, get_thumbnail_name
+from .views import TimedeltaWrapper, get_dashboard_stats
+from .sketches import DurationSketch
+
+User = get_user_model()
+
+
+def get_html_bouquets(html):
+    """Get bouquets of tiles in html of catalog page by their names"""
+    return [Bouquet.objects.get(name=name) for name in re.findall(r'block_intro">(букет \d+)<', html)]
+
+
+class DashboardTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.windows = [
+            DeliveryWindow.objects.create(name='с 10 до 12', from_hour=10, to_hour=12),
+            DeliveryWindow.objects.create(name='с 12 до 14', from_hour=12, to_hour=14),
+        ]
+        cls.bouquets = [
+            Bouquet.objects.create(name=f'букет {i}', description='', photo='bouquet.jpg', price=1000 * (i + 1),
+                                   height_cm=30, width_cm=20)
+            for i in range(2)
+        ]
+        # orders are created, composed and delivered in one day, from 10:00 to 21:00
+        created_at = get_day_start(timezone.localdate() - datetime.timedelta(days=3)) + datetime.timedelta(hours=10)
+        for i in range(10):
+            bouquet = cls.bouquets[i % 2]
+            Order.objects.create(
+                bouquet=bouquet,
+                price=bouquet.price,
+                client_name=f'клиент {i % 4}',
+                phone=f'+7900000000{i % 4}',
+                delivery_address='адрес',
+                delivery_window=cls.windows[int(i < 7)],
+                paid=True,
+                status=Order.Status.cancelled if i == 9 else Order.Status.delivered,
+                created_at=created_at + datetime.timedelta(hours=i),
+                composed_at=created_at + datetime.timedelta(hours=i, minutes=30),
+                delivered_at=created_at + datetime.timedelta(hours=i + 2),
+            )
+        cls.manager = User.objects.create_user(username='manager', password='password', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+
+class DashboardSummaryTest(DashboardTestCase):
+    def test_summary_is_computed_by_one_scan(self):
+        orders = Order.objects.exclude(status=Order.Status.cancelled)
+        # one query for delivery windows (then they are cached) and one for orders
+        with self.assertNumQueries(2):
+            summary = orders.dashboard_summary()
+
+        self.assertEqual(summary['orders_count'], 9)
+        self.assertEqual(summary['orders_sum'], 13000)
+        self.assertEqual(summary['unique_clients_count'], 4)
+        self.assertEqual(summary['order_to_compose_avg_time'], datetime.timedelta(minutes=30))
+        self.assertEqual(summary['most_popular_window'], 'с 12 до 14')
+
+    def test_rollups_summary_is_equal_to_orders_summary(self):
+        orders_summary = Order.objects.exclude(status=Order.Status.cancelled).dashboard_summary()
+        with self.assertNumQueries(1):
+            rollups_summary = OrderRollup.objects.dashboard_summary()
+
+        del orders_summary['unique_clients_count']
+        self.assertEqual(rollups_summary, orders_summary)
+
+    def test_rollups_stats_are_equal_to_orders_aggregates(self):
+        # durations differ between orders, one order is composed next day after start of work day
+        created_at = get_day_start(timezone.localdate() - datetime.timedelta(days=2)) + datetime.timedelta(hours=19)
+        for i, bouquet in enumerate([self.bouquets[1]] * 3):
+            Order.objects.create(bouquet=bouquet, price=bouquet.price, client_name='клиент', phone='+79000000009',
+                                 delivery_address='адрес', paid=True, status=Order.Status.delivered,
+                                 created_at=created_at + datetime.timedelta(minutes=50 * i),
+                                 composed_at=created_at + datetime.timedelta(hours=i * 7, minutes=20),
+                                 delivered_at=created_at + datetime.timedelta(hours=i * 7 + 1))
+
+        for period, bouquet in [('all', 'any'), ('week', 'any'), ('all', str(self.bouquets[1].id))]:
+            with self.subTest(period=period, bouquet=bouquet):
+                stats = get_dashboard_stats(period, bouquet)
+                filters = Order.get_dashboard_period_filters(period)
+                all_orders = Order.objects.exclude(status=Order.Status.cancelled).filter(**filters)
+                orders = all_orders if bouquet == 'any' else all_orders.filter(bouquet_id=int(bouquet))
+
+                self.assertEqual(stats['by_hours_distribution'], orders.get_by_hours_distribution())
+                # top bouquets are computed without filter of bouquet
+                self.assertEqual(stats['top_bouquets'], list(all_orders.get_top_n_bouquets(5)))
+                for name, avg_time in orders.get_order_points_avg().items():
+                    self.assertEqual(stats[name].td, avg_time)
+
+    def test_stats_queries_count(self):
+        self.client.force_login(self.manager)
+        # session, user, top clients, top bouquets, bouquet of filter, rollups summary with delivery windows,
+        # daily sketches (with unique clients), consultations, hours and time distributions, weekdays and hours heatmap,
+        # bouquets of filter form
+        with self.assertNumQueries(14):
+            response = self.client.get(reverse('stats'), {'period': 'all', 'bouquet': self.bouquets[0].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['orders_count'], 5)
+        self.assertEqual(response.context['unique_clients_count'], 2)
+
+    def test_heatmap_is_equal_to_orders_heatmap(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('stats_heatmap'), {'period': 'all', 'bouquet': 'any'})
+        self.assertEqual(response.status_code, 200)
+
+        heatmap = response.json()['heatmap']
+        self.assertEqual(heatmap, Order.objects.exclude(status=Order.Status.cancelled).get_weekday_hour_heatmap())
+        self.assertEqual(sum(map(sum, heatmap)), 9)
+
+    def test_time_series_has_no_gaps(self):
+        first_order = Order.objects.earliest('created_at')
+        start = get_day_start(timezone.localdate(first_order.created_at))
+        end = start + datetime.timedelta(days=2)
+        orders = Order.objects.exclude(status=Order.Status.cancelled)
+
+        granularity, time_series = orders.get_time_series('hour', start, end)
+        self.assertEqual(granularity, 'hour')
+        self.assertEqual(len(time_series), 48)
+        self.assertEqual(sum(row['num'] for row in time_series), 9)
+        self.assertEqual(OrderRollup.objects.get_time_series('hour', start, end), (granularity, time_series))
+
+        # too many hours in year, so granularity is coarsened
+        granularity, time_series = orders.get_time_series('hour', start, start + datetime.timedelta(days=365))
+        self.assertEqual(granularity, 'day')
+        self.assertEqual(len(time_series), 365)
+
+    @override_settings(DASHBOARD_EXACT_UNIQUE_CLIENTS=True)
+    def test_stats_exact_unique_clients(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('stats'), {'period': 'all', 'bouquet': 'any'})
+        self.assertEqual(response.context['unique_clients_count'], 4)
+        self.assertIsNone(response.context['unique_clients_count_error'])
+
+
+class DashboardCacheTest(DashboardTestCase):
+    def get_stats(self):
+        return self.client.get(reverse('stats'), {'period': 'all', 'bouquet': 'any'})
+
+    def test_repeat_stats_view_is_cached(self):
+        self.client.force_login(self.manager)
+        self.get_stats()
+        # session, user and bouquets of filter form
+        with self.assertNumQueries(3):
+            response = self.get_stats()
+        self.assertEqual(response.context['orders_count'], 9)
+
+    def test_order_change_invalidates_stats(self):
+        self.client.force_login(self.manager)
+        self.get_stats()
+
+        order = Order.objects.get(status=Order.Status.cancelled)
+        order.status = Order.Status.delivered
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+
+        self.assertEqual(self.get_stats().context['orders_count'], 10)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(),
+    }
+})
+class DashboardFileCacheTest(DashboardCacheTest):
+    pass
+
+
+class DashboardPeriodRangeTest(TestCase):
+    @staticmethod
+    def local(*args):
+        return timezone.make_aware(datetime.datetime(*args))
+
+    def test_periods_are_bounded_by_local_midnights(self):
+        # it is still 14 January by UTC
+        now = self.local(2024, 1, 15, 1, 30)
+        expected_ranges = {
+            'all': (None, None),
+            'today': (self.local(2024, 1, 15), self.local(2024, 1, 16)),
+            'week': (self.local(2024, 1, 9), self.local(2024, 1, 16)),
+            'month': (self.local(2023, 12, 16), self.local(2024, 1, 16)),
+            'year': (self.local(2023, 1, 16), self.local(2024, 1, 16)),
+            'this_month': (self.local(2024, 1, 1), self.local(2024, 2, 1)),
+            'this_year': (self.local(2024, 1, 1), self.local(2025, 1, 1)),
+            'previous_month': (self.local(2023, 12, 1), self.local(2024, 1, 1)),
+            'previous_year': (self.local(2023, 1, 1), self.local(2024, 1, 1)),
+        }
+        self.assertEqual(set(expected_ranges), set(Order.DashboardFilterPeriod.names))
+        for period, expected_range in expected_ranges.items():
+            with self.subTest(period=period):
+                self.assertEqual(Order.get_dashboard_period_range(period, now), expected_range)
+
+        now = self.local(2023, 12, 31, 23, 59)
+        self.assertEqual(Order.get_dashboard_period_range('this_month', now),
+                         (self.local(2023, 12, 1), self.local(2024, 1, 1)))
+        self.assertEqual(Order.get_dashboard_period_range('previous_month', now),
+                         (self.local(2023, 11, 1), self.local(2023, 12, 1)))
+
+    def test_range_includes_start_and_excludes_end(self):
+        bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                         height_cm=30, width_cm=20)
+        start, end = self.local(2023, 12, 1), self.local(2024, 1, 1)
+        moment = datetime.timedelta(microseconds=1)
+        for created_at in [start - moment, start, end - moment, end]:
+            Order.objects.create(bouquet=bouquet, price=1000, client_name='клиент', phone='+79000000000',
+                                 delivery_address='адрес', paid=True, created_at=created_at)
+
+        now = self.local(2024, 1, 15, 1, 30)
+        orders = Order.objects.filter(**Order.get_dashboard_period_filters('previous_month', now))
+        self.assertEqual(sorted(orders.values_list('created_at', flat=True)), [start, end - moment])
+        rollups = OrderRollup.objects.filter(**OrderRollup.get_dashboard_period_filters('previous_month', now))
+        self.assertEqual(rollups.aggregate(Sum('orders_count'))['orders_count__sum'], 2)
+
+
+class OrderRollupMaintenanceTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bouquets = [
+            Bouquet.objects.create(name=f'букет {i}', description='', photo='bouquet.jpg', price=1000,
+                                   height_cm=30, width_cm=20)
+            for i in range(2)
+        ]
+        cls.window = DeliveryWindow.objects.create(name='утро', from_hour=9, to_hour=12)
+        cls.created_at = get_day_start(timezone.localdate() - datetime.timedelta(days=2)) + datetime.timedelta(hours=9)
+
+    def create_order(self, **fields):
+        return Order.objects.create(**{
+            'bouquet': self.bouquets[0],
+            'price': 1000,
+            'client_name': 'клиент',
+            'phone': '+79000000000',
+            'delivery_address': 'адрес',
+            'paid': True,
+            'created_at': self.created_at,
+            **fields,
+        })
+
+    def assertRollupsEqualToOrders(self):
+        self.assertEqual(OrderRollup.objects.get_mismatched_days(), [])
+        self.assertEqual(OrderDailySketch.objects.get_mismatched_days(), [])
+
+    def test_rollups_follow_changes_of_orders(self):
+        orders = [
+            self.create_order(),
+            self.create_order(bouquet=self.bouquets[1], delivery_window=self.window, phone='+79000000001',
+                              composed_at=self.created_at + datetime.timedelta(minutes=40)),
+            self.create_order(created_at=self.created_at + datetime.timedelta(days=1, hours=3)),
+        ]
+        self.assertRollupsEqualToOrders()
+        self.assertEqual(OrderRollup.objects.count(), 3)
+
+        # only price is saved, status is changed only in memory
+        orders[0].price = 1500
+        orders[0].status = Order.Status.cancelled
+        orders[0].save(update_fields=['price'])
+        self.assertRollupsEqualToOrders()
+        self.assertEqual(OrderRollup.objects.aggregate(Sum('orders_sum'))['orders_sum__sum'], 3500)
+
+        orders[1].status = Order.Status.cancelled
+        orders[1].save()
+        self.assertRollupsEqualToOrders()
+
+        # order is moved to other day
+        orders[2].created_at = self.created_at
+        orders[2].delivered_at = self.created_at + datetime.timedelta(hours=2)
+        orders[2].save()
+        self.assertRollupsEqualToOrders()
+
+        # state of order with deferred fields is loaded from database
+        order = Order.objects.only('id', 'price').get(id=orders[0].id)
+        order.price = 2000
+        order.save()
+        self.assertRollupsEqualToOrders()
+        self.assertEqual(OrderRollup.objects.aggregate(Sum('orders_sum'))['orders_sum__sum'], 3000)
+        order = Order.objects.only('id', 'created_at').get(id=orders[0].id)
+        order.created_at += datetime.timedelta(days=1)
+        order.save()
+        self.assertRollupsEqualToOrders()
+
+        orders[2].delete()
+        Order.objects.only('id').get(id=orders[0].id).delete()
+        self.assertRollupsEqualToOrders()
+        self.assertFalse(OrderRollup.objects.exists())
+
+
+class RebuildOrderRollupsCommandTest(TransactionTestCase):
+    def test_rollups_are_rebuilt_and_checked(self):
+        bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                         height_cm=30, width_cm=20)
+        created_at = get_day_start(timezone.localdate() - datetime.timedelta(days=40)) + datetime.timedelta(hours=9)
+        for i in range(10):
+            Order.objects.create(bouquet=bouquet, price=1000, client_name='клиент', phone=f'+7900000000{i % 3}',
+                                 delivery_address='адрес', paid=True,
+                                 created_at=created_at + datetime.timedelta(days=i * 4, hours=i))
+        rollups = list(OrderRollup.objects.order_by('day', 'hour').values())
+        OrderRollup.objects.all().delete()
+        OrderDailySketch.objects.all().delete()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command('rebuild_order_rollups', '--chunk-days', '7', '--workers', '1')
+        self.assertIn('rollups are equal to orders', out.getvalue())
+        self.assertEqual(list(OrderRollup.objects.order_by('day', 'hour').values('day', 'hour', 'orders_count')),
+                         [{key: rollup[key] for key in ('day', 'hour', 'orders_count')} for rollup in rollups])
+
+        # broken day is repaired by rebuild of this day only
+        day = timezone.localdate(created_at)
+        OrderRollup.objects.filter(day=day).update(orders_count=5)
+        self.assertEqual(OrderRollup.objects.get_mismatched_days(), [day])
+        dashboard_version = get_data_version('dashboard')
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('rebuild_order_rollups', '--date-from', str(day), '--date-to', str(day))
+        self.assertEqual(OrderRollup.objects.get_mismatched_days(), [])
+        # dashboard cached with broken rollups is not used
+        self.assertNotEqual(get_data_version('dashboard'), dashboard_version)
+
+
+class DurationSketchTest(TestCase):
+    def test_quantiles_have_relative_accuracy(self):
+        durations = [datetime.timedelta(minutes=minutes) for minutes in range(1, 1001)]
+        first_half, second_half = DurationSketch(), DurationSketch()
+        for i, duration in enumerate(durations):
+            (first_half if i % 2 else second_half).add(duration)
+        first_half.merge(second_half)
+
+        for q in (0.5, 0.9, 0.99):
+            exact = durations[int(q * (len(durations) - 1))]
+            self.assertLessEqual(abs(first_half.quantile(q) - exact), exact * DurationSketch.RELATIVE_ACCURACY)
+
+    def test_long_and_zero_durations_are_shown(self):
+        long_duration = TimedeltaWrapper(datetime.timedelta(days=2, hours=3, minutes=15))
+        self.assertEqual((long_duration.hours, long_duration.minutes60), (51, 15))
+        zero_duration = TimedeltaWrapper(datetime.timedelta())
+        self.assertEqual((zero_duration.hours, zero_duration.minutes60), (0, 0))
+        self.assertEqual(TimedeltaWrapper(None).hours, '---')
+
+        sketch = DurationSketch()
+        for hours in (26, 30, 30):
+            sketch.add(datetime.timedelta(hours=hours))
+        p99 = TimedeltaWrapper(sketch.quantile(0.99))
+        self.assertAlmostEqual(p99.hours, 30, delta=30 * DurationSketch.RELATIVE_ACCURACY + 1)
+
+    def test_daily_sketches_follow_orders(self):
+        cache.clear()
+        bouquet = Bouquet.objects.create(name='букет', description='', photo='bouquet.jpg', price=1000,
+                                         height_cm=30, width_cm=20)
+        created_at = timezone.now().replace(hour=12) - datetime.timedelta(days=1)
+        order = Order.objects.create(bouquet=bouquet, price=1000, client_name='клиент', phone='+79000000000',
+                                     delivery_address='адрес', paid=True, created_at=created_at)
+        order.composed_at = created_at + datetime.timedelta(minutes=40)
+        order.save()
+
+        sketches, clients = OrderDailySketch.objects.get_merged_sketches()
+        self.assertEqual(clients.estimate(), 1)
+        self.assertEqual(sketches['order_to_compose'].count, 1)
+        compose_time = sketches['order_to_compose'].quantile(0.5)
+        self.assertAlmostEqual(compose_time.total_seconds(), 40 * 60, delta=40 * 60 * DurationSketch.RELATIVE_ACCURACY)
+
+        order.status = Order.Status.cancelled
+        order.save()
+        self.assertFalse(OrderDailySketch.objects.exists())
+
+
+class StatsExportTest(DashboardTestCase):
+    def test_orders_are_streamed_as_csv(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(
+            reverse('stats_export', args=['orders']),
+            {'period': 'all', 'bouquet': self.bouquets[0].id, 'format': 'csv'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), ORDER_EXPORT_FIELDS)
+        self.assertEqual(len(lines), 1 + 5)
+
+    def test_consultations_are_streamed_as_jsonl(self):
+        Consultation.objects.create(client_name='клиент', phone='+79000000000')
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('stats_export', args=['consultations']), {'format': 'jsonl'})
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['phone'], '+79000000000')
+
+    def test_export_is_only_for_staff(self):
+        self.client.force_login(User.objects.create_user(username='client', password='password'))
+        response = self.client.get(reverse('stats_export', args=['orders']))
+        self.assertEqual(response.status_code, 302)
+
+
+class RecommendationIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = [Event.objects.create(name=f'событие {i}') for i in range(12)]
+        for i, price in enumerate([500, 1500, 1500, 3000, 5000]):
+            bouquet = Bouquet.objects.create(name=f'букет {i}', description='', photo='bouquet.jpg', price=price,
+                                             height_cm=30, width_cm=20)
+            bouquet.events.set(cls.events[i % 2::2] if i < 4 else [cls.events[11]])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recommendations_are_ranked(self):
+        index = RecommendationIndex.build()
+        recommended_bouquets = index.recommend(str(self.events[1].id), '1000', '2000', k=5)
+
+        # in budget with event, in budget, out of budget with event, out of budget
+        names = [bouquet.name for bouquet in recommended_bouquets]
+        self.assertEqual(names[:3], ['букет 1', 'букет 2', 'букет 3'])
+        self.assertCountEqual(names, [f'букет {i}' for i in range(5)])
+        # most expensive bouquet if budget is unknown
+        self.assertEqual(index.recommend('unknown', 'unknown', '')[0].name, 'букет 4')
+
+    def test_availability_and_sales_raise_score(self):
+        cheap_bouquet, expensive_bouquet = Bouquet.objects.filter(price=1500).order_by('id')
+        params = ('', '1000', '2000')
+        self.assertEqual(RecommendationIndex.build().recommend(*params)[0], expensive_bouquet)
+
+        shop = FlowerShop.objects.create(address='адрес')
+        catalog_item = FlowerShopCatalogItem.objects.create(flower_shop=shop, bouquet=cheap_bouquet)
+        self.assertEqual(RecommendationIndex.build().recommend(*params)[0], cheap_bouquet)
+
+        catalog_item.delete()
+        OrderRollup.objects.create(day=timezone.localdate(), hour=12, bouquet=cheap_bouquet, orders_count=10,
+                                   orders_sum=15000)
+        self.assertEqual(RecommendationIndex.build().recommend(*params)[0], cheap_bouquet)
+
+    def test_candidates_are_bounded_by_budget(self):
+        for i in range(30):
+            Bouquet.objects.create(name=f'букет {i + 5}', description='', photo='bouquet.jpg', price=2000 + i * 100,
+                                   height_cm=30, width_cm=20)
+        index = RecommendationIndex.build()
+        with mock.patch('flowerapp.recommendations.RECOMMENDATION_CANDIDATES', 3), \
+                mock.patch.object(index, 'get_budget_fit', wraps=index.get_budget_fit) as get_budget_fit:
+            recommended_bouquets = index.recommend(str(self.events[1].id), '2000', '4900', k=3)
+        # bouquets closest to middle of budget and bouquet of event in budget
+        self.assertEqual([bouquet.price for bouquet in recommended_bouquets], [3000, 3500, 3400])
+        self.assertEqual(recommended_bouquets[0].name, 'букет 3')
+        self.assertEqual(get_budget_fit.call_count, 5)
+
+    def test_result_does_not_query_database(self):
+        params = {'event': self.events[1].id, 'price_from': 1000, 'price_to': 2000}
+        self.client.get(reverse('result'), params)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('result'), params)
+        self.assertEqual(response.context['bouquet'].name, 'букет 1')
+
+    def test_index_is_rebuilt_on_catalog_change(self):
+        params = {'event': self.events[11].id, 'price_from': 1000, 'price_to': 10000}
+        self.assertEqual(self.client.get(reverse('result'), params).context['bouquet'].name, 'букет 4')
+
+        bouquet = Bouquet.objects.get(name='букет 3')
+        with self.captureOnCommitCallbacks(execute=True):
+            bouquet.events.add(self.events[11])
+        with self.captureOnCommitCallbacks(execute=True):
+            Bouquet.objects.filter(name='букет 4').update(price=100)
+            Bouquet.objects.get(name='букет 4').save()
+
+        self.assertEqual(self.client.get(reverse('result'), params).context['bouquet'].name, 'букет 3')
+
+
+class CatalogPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(20):
+            Bouquet.objects.create(name=f'букет {i}', description='', photo='bouquet.jpg', price=1000 * (i % 3 + 1),
+                                   height_cm=30, width_cm=20)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_cover_catalog_in_order(self):
+        response = self.client.get(reverse('catalog'))
+        self.assertEqual(response.context['count_items'], 20)
+        bouquets = list(response.context['bouquets'])
+        cursor = response.context['next_cursor']
+        while cursor:
+            # page cost doesn't depend on depth
+            with self.assertNumQueries(1):
+                page = self.client.get(reverse('catalog_page'), {'after': cursor}).json()
+            bouquets += get_html_bouquets(page['html'])
+            cursor = page['next_cursor']
+
+        self.assertEqual(bouquets, list(Bouquet.objects.order_by('price', 'id')))
+
+    def test_invalid_cursor_returns_first_page(self):
+        first_page = self.client.get(reverse('catalog_page')).json()
+        for cursor in ['unknown', 'NaN_1', 'sNaN_1', 'Infinity_1']:
+            with self.subTest(cursor=cursor):
+                page = self.client.get(reverse('catalog_page'), {'after': cursor}).json()
+                self.assertEqual(page, first_page)
+        self.assertIsNotNone(first_page['next_cursor'])
+        self.assertEqual(first_page['html'].count('show-item'), 6)
+
+
+class FacetIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = [Event.objects.create(name=f'событие {i}') for i in range(3)]
+        cls.items = [BouquetItem.objects.create(name=f'цветок {i}') for i in range(3)]
+        for i in range(18):
+            bouquet = Bouquet.objects.create(name=f'букет {i}', description='', photo='bouquet.jpg', price=800 * i,
+                                             height_cm=25 + 5 * i, width_cm=20)
+            bouquet.events.set(cls.events[:i % 3 + 1])
+            BouquetItemsInBouquet.objects.create(bouquet=bouquet, item=cls.items[i % 3])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_are_equal_to_database_counts(self):
+        index = FacetIndex.build()
+        selection = {'event': [str(self.events[2].id)], 'price': ['middle', 'expensive']}
+        facets = {facet['name']: facet for facet in index.get_facets(selection)}
+
+        bouquets = Bouquet.objects.filter(events=self.events[2], price__gte=1000)
+        self.assertEqual(index.count(selection), bouquets.count())
+        for item in self.items:
+            flower_value = next(value for value in facets['flower']['values'] if value['value'] == str(item.id))
+            self.assertEqual(flower_value['count'], bouquets.filter(items__item=item).count())
+        # count of value of selected facet doesn't depend on selection of this facet
+        cheap_value = next(value for value in facets['price']['values'] if value['value'] == 'cheap')
+        self.assertEqual(cheap_value['count'], Bouquet.objects.filter(events=self.events[2], price__lt=1000).count())
+        self.assertFalse(cheap_value['selected'])
+
+    def test_filtered_catalog_is_paginated_in_memory(self):
+        params = {'flower': [self.items[0].id, self.items[1].id], 'size': ['medium', 'large', 'unknown']}
+        response = self.client.get(reverse('catalog'), params)
+        expected_bouquets = list(
+            Bouquet.objects.filter(items__item__in=self.items[:2], height_cm__gte=40).order_by('price', 'id')
+        )
+        self.assertEqual(response.context['count_items'], len(expected_bouquets))
+
+        bouquets = list(response.context['bouquets'])
+        with self.assertNumQueries(0):
+            page = self.client.get(reverse('catalog_page'), {**params, 'after': response.context['next_cursor']})
+        bouquets += get_html_bouquets(page.json()['html'])
+        self.assertIsNone(page.json()['next_cursor'])
+        self.assertEqual(bouquets, expected_bouquets)
+
+    def test_invalid_cursor_returns_first_filtered_page(self):
+        params = {'price': ['cheap', 'middle']}
+        first_page = self.client.get(reverse('catalog_page'), params).json()
+        for cursor in ['unknown', 'NaN_1', 'sNaN_1', 'Infinity_1']:
+            with self.subTest(cursor=cursor):
+                page = self.client.get(reverse('catalog_page'), {**params, 'after': cursor}).json()
+                self.assertEqual(page, first_page)
+        self.assertEqual(get_html_bouquets(first_page['html'])[0], Bouquet.objects.order_by('price', 'id').first())
+
+
+class BouquetSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rose = BouquetItem.objects.create(name='Роза красная')
+        cls.tulip = BouquetItem.objects.create(name='Тюльпан')
+        cls.bouquets = [
+            Bouquet.objects.create(name='Нежность', description='Букет из красных роз для любимой',
+                                   photo='bouquet.jpg', price=3000, height_cm=40, width_cm=30),
+            Bouquet.objects.create(name='Весна', description='Яркие тюльпаны', photo='bouquet.jpg', price=2000,
+                                   height_cm=30, width_cm=20),
+        ]
+        BouquetItemsInBouquet.objects.create(bouquet=cls.bouquets[1], item=cls.rose)
+
+    def search(self, query):
+        return self.client.get(reverse('search'), {'q': query}).json()['bouquets']
+
+    def test_inflected_words_are_found(self):
+        self.assertEqual(stem('розами'), stem('роза'))
+        self.assertEqual([bouquet['name'] for bouquet in self.search('тюльпан')], ['Весна'])
+        self.assertCountEqual([bouquet['name'] for bouquet in self.search('красные розы')], ['Нежность', 'Весна'])
+        # items are more relevant than description
+        self.assertEqual([bouquet['name'] for bouquet in self.search('розы')], ['Весна', 'Нежность'])
+        self.assertEqual([bouquet['name'] for bouquet in self.search('Весна роз')], ['Весна'])
+
+    def test_index_follows_catalog_changes(self):
+        self.tulip.name = 'Пион'
+        self.tulip.save()
+        BouquetItemsInBouquet.objects.create(bouquet=self.bouquets[0], item=self.tulip)
+        self.assertEqual([bouquet['name'] for bouquet in self.search('пионы')], ['Нежность'])
+
+        self.bouquets[1].name = 'Лето'
+        self.bouquets[1].save()
+        self.assertEqual([bouquet['name'] for bouquet in self.search('весна')], [])
+        self.assertEqual([bouquet['name'] for bouquet in self.search('лето')], ['Лето'])
+
+        self.bouquets[0].delete()
+        self.assertEqual(self.search('пион'), [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ThumbnailsTest(TestCase):
+    def test_thumbnails_are_generated_on_save(self):
+        photo = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'red').save(photo, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            bouquet = Bouquet.objects.create(name='букет', description='', price=1000, height_cm=30, width_cm=20,
+                                             photo=SimpleUploadedFile('bouquet.jpg', photo.getvalue()))
+
+        for width in THUMBNAIL_WIDTHS:
+            with default_storage.open(get_thumbnail_name(bouquet.photo.name, width, 'webp')) as thumbnail_file:
+                self.assertEqual(Image.open(thumbnail_file).size, (width, round(width * 2 / 3)))
+
+        html = Template('{% load thumbnails %}{% photo_picture photo sizes="400px" %}').render(
+            Context({'photo': bouquet.photo})
+        )
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'{default_storage.url(get_thumbnail_name(bouquet.photo.name, 640, "jpg"))} 640w', html)
+
+
+class BouquetTileCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bouquet = Bouquet.objects.create(name='букет 1', description='', photo='bouquet.jpg', price=1000,
+                                             height_cm=30, width_cm=20, is_recommended=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tiles_are_cached_until_bouquet_is_saved(self):
+        for url in [reverse('index'), reverse('catalog')]:
+            self.client.get(url)
+            # update doesn't change updated_at, so cached tile is shown
+            Bouquet.objects.filter(id=self.bouquet.id).update(price=2000)
+            self.assertContains(self.client.get(url), '1 000 руб')
+
+            bouquet = Bouquet.objects.get(id=self.bouquet.id)
+            bouquet.save()
+            self.assertContains(self.client.get(url), '2 000 руб')
+            self.bouquet.save()
+
+
+class PublicPagesConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bouquet = Bouquet.objects.create(name='букет 1', description='', photo='bouquet.jpg', price=1000,
+                                             height_cm=30, width_cm=20, is_recommended=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_etag(self, url):
+        # first page sets CSRF cookie, so only second page has ETag
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        return response['ETag']
+
+    def test_not_modified_pages(self):
+        for url in [reverse('index'), reverse('catalog'), reverse('card', args=[self.bouquet.id])]:
+            etag = self.get_etag(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_pages_are_modified_by_catalog_and_cookies(self):
+        url = reverse('catalog')
+        etag = self.get_etag(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bouquet.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.get_etag(url)
+        self.client.cookies['success_alert_style'] = 'block'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_form_is_posted(self):
+        url = reverse('index')
+        etag = self.get_etag(url)
+        response = self.client.post(url, {'client_name': 'Иван', 'phone': '+79990000000'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Consultation.objects.exists())
+
+
+class DeliveryWindowChoicesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_choices_are_cached_until_windows_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            window = DeliveryWindow.objects.create(name='утро', from_hour=9, to_hour=12)
+        self.assertEqual(list(OrderForm().fields['delivery_window'].choices), [(window.id, 'утро')])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(OrderForm().fields['delivery_window'].choices), [(window.id, 'утро')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            window.name = 'вечер'
+            window.save()
+        self.assertEqual(list(OrderForm().fields['delivery_window'].choices), [(window.id, 'вечер')])
+
+
+@override_settings(LINK_PAY='http://pay/?amount=')
+class OrderPlacementTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bouquet = Bouquet.objects.create(name='букет 1', description='', photo='bouquet.jpg', price=1000,
+                                             height_cm=30, width_cm=20)
+        cls.window = DeliveryWindow.objects.create(name='утро', from_hour=9, to_hour=12)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_submit_creates_one_order(self):
+        url = reverse('order', args=[self.bouquet.id])
+        form = self.client.get(url).context['form']
+        data = {
+            'idempotency_key': form['idempotency_key'].value(),
+            'client_name': 'Иван',
+            'phone': '+79990000000',
+            'delivery_address': 'адрес',
+            'delivery_window': self.window.id,
+        }
+        for _ in range(2):
+            self.assertRedirects(self.client.post(url, data), 'http://pay/?amount=1000.0',
+                                 fetch_redirect_response=False)
+
+        order = Order.objects.get()
+        self.assertEqual(str(order.idempotency_key), str(data['idempotency_key']))
+        self.assertEqual(order.delivery_window, self.window)
+        self.assertEqual(OrderRollup.objects.get().orders_count, 1)
+
+        # other form is other order
+        data['idempotency_key'] = self.client.get(url).context['form']['idempotency_key'].value()
+        self.client.post(url, data)
+        self.assertEqual(Order.objects.count(), 2)
@@ -0,0 +1,74 @@
+import io
+import logging
+import os
+from typing import Iterable, Optional
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .caching import bump_data_version
+from .models import Bouquet
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = (320, 640, 960)
+# format is extension of file and format of Pillow, first format is preferred by browsers which support it
+THUMBNAIL_FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+THUMBNAIL_QUALITY = 80
+
+
+def get_thumbnail_name(photo_name: str, width: int, extension: str) -> str:
+    """Get name of thumbnail in storage, thumbnails are stored next to photo: photo.png -> photo_320w.webp"""
+    root, _ = os.path.splitext(photo_name)
+    return f'{root}_{width}w.{extension}'
+
+
+def has_thumbnails(photo_name: str) -> bool:
+    return all(
+        default_storage.exists(get_thumbnail_name(photo_name, width, extension))
+        for width in THUMBNAIL_WIDTHS
+        for extension in THUMBNAIL_FORMATS
+    )
+
+
+def generate_thumbnails(photo_name: str, force: bool = False) -> Optional[list[str]]:
+    """Generate thumbnails of photo for all widths and formats, return their names or None if photo can't be read
+
+    Thumbnails are not wider than photo. Existing thumbnails are not regenerated without force.
+    """
+    if not force and has_thumbnails(photo_name):
+        return []
+    try:
+        with default_storage.open(photo_name) as photo_file:
+            photo = Image.open(photo_file)
+            photo.load()
+    except (OSError, UnidentifiedImageError) as error:  # FileNotFoundError is OSError too
+        logger.warning('thumbnails of %s are not generated: %s', photo_name, error)
+        return None
+
+    # JPEG has no alpha channel and palette images are converted by Pillow with loss anyway
+    photo = photo.convert('RGB')
+    thumbnails_names = []
+    for width in THUMBNAIL_WIDTHS:
+        thumbnail = photo
+        if photo.width > width:
+            thumbnail = photo.resize((width, max(round(photo.height * width / photo.width), 1)), Image.LANCZOS)
+        for extension, image_format in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, image_format, quality=THUMBNAIL_QUALITY)
+            thumbnail_name = get_thumbnail_name(photo_name, width, extension)
+            default_storage.delete(thumbnail_name)
+            thumbnails_names.append(default_storage.save(thumbnail_name, ContentFile(buffer.getvalue())))
+    return thumbnails_names
+
+
+def refresh_bouquets_tiles(photos_names: Iterable[str]) -> None:
+    """Renew updated_at of bouquets with photos, so their cached tiles are rendered again with new thumbnails"""
+    Bouquet.objects.filter(photo__in=list(photos_names)).update(updated_at=timezone.now())
+    # bouquets in indexes of catalog are reloaded with new updated_at
+    bump_data_version('catalog')
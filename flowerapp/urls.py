@@ -6,9 +6,14 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('card/<bouquet_id>/', views.card, name='card'),
     path('catalog/', views.catalog, name='catalog'),
+    path('catalog/page/', views.catalog_page, name='catalog_page'),
+    path('search/', views.search, name='search'),
     path('consultation/', views.consultation, name='consultation'),
     path('order/<bouquet_id>/', views.order, name='order'),
     path('quiz/', views.quiz, name='quiz'),
     path('result/', views.result, name='result'),
     path('stats/', views.stats, name='stats'),
+    path('stats/heatmap/', views.stats_heatmap, name='stats_heatmap'),
+    path('stats/time-series/', views.stats_time_series, name='stats_time_series'),
+    path('stats/export/<str:model_name>/', views.stats_export, name='stats_export'),
 ]
@@ -1,27 +1,75 @@
 import datetime
-from typing import Union
+import hashlib
+import uuid
+from typing import Any, Optional, Union
 from urllib.parse import urlencode
 
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.handlers.wsgi import WSGIRequest
 from django.conf import settings
-from django.db import models
-from django.db.models import Sum, Count, F, Case, When, Value, Avg, Min
-from django.db.models.functions import Concat
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
-
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+from .caching import get_data_modified
+from .caching import get_data_version
+from .caching import get_or_compute
+from .exports import CONSULTATION_EXPORT_FIELDS
+from .exports import EXPORT_FORMATS
+from .exports import ORDER_EXPORT_FIELDS
+from .exports import iter_export_rows
+from .facets import FACETS_TITLES
+from .facets import get_facet_index
 from .forms import ConsultationForm
 from .forms import CustomEventForm
 from .forms import OrderForm
 from .models import Bouquet
 from .models import Consultation
-from .models import DeliveryWindow
 from .models import Event
 from .models import FlowerShop
 from .models import Order
+from .models import OrderDailySketch
+from .models import OrderRollup
+from .models import get_default_granularity
+from .recommendations import get_recommendation_index
+from .search import search_bouquets
+from .sketches import ClientsSketch
+
+CATALOG_PAGE_SIZE = 6
+ORDER_POINTS_NAMES = {
+    'order_to_delivery': 'От заказа до доставки',
+    'order_to_compose': 'От заказа до сбора',
+    'compose_to_delivery': 'От сбора до доставки',
+}
+ORDER_POINTS_HISTOGRAM_BOUNDS = [
+    datetime.timedelta(minutes=minutes)
+    for minutes in (30, 60, 90, 120, 180, 240)
+]
+ORDER_POINTS_HISTOGRAM_LABELS = [
+    'до 30 мин', '30 мин - 1 ч', '1 - 1,5 ч', '1,5 - 2 ч', '2 - 3 ч', '3 - 4 ч', 'больше 4 ч'
+]
+WEEKDAYS_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+TIME_SERIES_GRANULARITIES_NAMES = {
+    'hour': 'По часам',
+    'day': 'По дням',
+    'week': 'По неделям',
+    'month': 'По месяцам',
+}
+TIME_SERIES_LABELS_FORMATS = {
+    'hour': '%d.%m %H:00',
+    'day': '%d.%m.%Y',
+    'week': 'с %d.%m.%Y',
+    'month': '%m.%Y',
+}
+EXPORT_MODELS_NAMES = {
+    'orders': 'заказы',
+    'consultations': 'консультации',
+}
 
 
 def redirect_with_success_alert(view_name: str, **kwargs) -> HttpResponse:
@@ -34,7 +82,7 @@ def redirect_with_success_alert(view_name: str, **kwargs) -> HttpResponse:
 
 
 class TimedeltaWrapper:
-    """Wrapper for datetime.timedelta which can return hours and minutes (reminded from hours).
+    """Wrapper for datetime.timedelta which can return hours (days included) and minutes (reminded from hours).
 
     If td is None return "---"
     Wrapper needs for django template
@@ -45,17 +93,51 @@ class TimedeltaWrapper:
 
     @property
     def hours(self):
-        if self.td:
-            return self.td.seconds // 3600
+        if self.td is not None:
+            return int(self.td.total_seconds() // 3600)
         return '---'
 
     @property
     def minutes60(self):
-        if self.td:
-            return (self.td.seconds // 60) % 60
+        if self.td is not None:
+            return int(self.td.total_seconds() // 60) % 60
         return '---'
 
 
+def get_public_page_etag(request: WSGIRequest, *args, **kwargs) -> Optional[str]:
+    """ETag of public page (index, catalog, card), None if page can't be validated
+
+    Page is rendered from catalog, cookie success_alert_style, user (menu) and CSRF cookie (token of form
+    is valid only with it), so ETag is changed with any of them. ETag is checked by browser and proxies for URL,
+    so query and URL params are not in ETag. Page without CSRF cookie sets it, so it has no ETag.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if request.method not in ('GET', 'HEAD') or not csrf_cookie:
+        return None
+    parts = [
+        get_data_version('catalog'),
+        request.COOKIES.get('success_alert_style', 'none'),
+        request.user.is_anonymous,
+        csrf_cookie,
+    ]
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def get_public_page_last_modified(request: WSGIRequest, *args, **kwargs) -> Optional[datetime.datetime]:
+    """Time of last change of catalog, only for pages with ETag, because it doesn't cover cookies and user"""
+    if get_public_page_etag(request) is None:
+        return None
+    return get_data_modified('catalog')
+
+
+# catalog version is bumped by changes of bouquets, events, items and shops (see flowerapp.signals),
+# pages have CSRF token of visitor, so they are cached only by browsers and always revalidated
+public_page_condition = condition(etag_func=get_public_page_etag, last_modified_func=get_public_page_last_modified)
+
+
+@cache_control(private=True, no_cache=True)
+@vary_on_cookie
+@public_page_condition
 def index(request: WSGIRequest) -> HttpResponse:
     context = {
         'bouquets': Bouquet.objects.filter(is_recommended=True),
@@ -72,6 +154,9 @@ def index(request: WSGIRequest) -> HttpResponse:
     return render(request, 'index.html', context)
 
 
+@cache_control(private=True, no_cache=True)
+@vary_on_cookie
+@public_page_condition
 def card(request: WSGIRequest, bouquet_id: int) -> HttpResponse:
     bouquets = Bouquet.objects.prefetch_related('items', 'items__item')
 
@@ -88,12 +173,44 @@ def card(request: WSGIRequest, bouquet_id: int) -> HttpResponse:
     return render(request, 'card.html', context)
 
 
+def get_catalog_selection(request: WSGIRequest) -> dict[str, list[str]]:
+    """Get selected values of facets of catalog filter from request"""
+    return {facet: request.GET.getlist(facet) for facet in FACETS_TITLES}
+
+
+def get_catalog_page(selection: dict[str, list[str]], cursor: Optional[str]) -> tuple[list[Bouquet], Optional[str]]:
+    """Get page of catalog after cursor by facet index if facets are selected and by database otherwise"""
+    facet_index = get_facet_index()
+    if facet_index.clean_selection(selection):
+        return facet_index.get_catalog_page(selection, cursor, CATALOG_PAGE_SIZE)
+    return Bouquet.objects.get_catalog_page(cursor, CATALOG_PAGE_SIZE)
+
+
+@cache_control(private=True, no_cache=True)
+@vary_on_cookie
+@public_page_condition
 def catalog(request: WSGIRequest) -> HttpResponse:
-    bouquets = Bouquet.objects.all()
+    selection = get_catalog_selection(request)
+    facet_index = get_facet_index()
+    query = request.GET.get('q', '').strip()
+    bouquets, next_cursor = get_catalog_page(selection, None)
+
+    if query:
+        # found bouquets are ranked by relevance, so they are shown by one page without facets
+        bouquets, next_cursor = search_bouquets(query), None
+        count_items = len(bouquets)
+    elif facet_index.clean_selection(selection):
+        count_items = facet_index.count(selection)
+    else:
+        # catalog version changes on every change of bouquets (see flowerapp.signals)
+        count_items = get_or_compute('catalog', ['bouquets_count'], Bouquet.objects.count)
 
     context = {
         'bouquets': bouquets,
-        'count_items': len(bouquets),
+        'next_cursor': next_cursor,
+        'count_items': count_items,
+        'facets': facet_index.get_facets(selection),
+        'query': query,
         'success_alert_style': request.COOKIES.get('success_alert_style', 'none'),
         'form': ConsultationForm(class_name='consultation__form_input'),
     }
@@ -106,6 +223,25 @@ def catalog(request: WSGIRequest) -> HttpResponse:
     return render(request, 'catalog.html', context)
 
 
+def catalog_page(request: WSGIRequest) -> JsonResponse:
+    """Next page of catalog for infinite scroll: html of bouquets after cursor and cursor of next page"""
+    bouquets, next_cursor = get_catalog_page(get_catalog_selection(request), request.GET.get('after'))
+    html = render_to_string('catalog_bouquets.html', {'bouquets': bouquets}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+
+def search(request: WSGIRequest) -> JsonResponse:
+    """Bouquets found by words of query in names, descriptions and items, ordered by relevance"""
+    bouquets = search_bouquets(request.GET.get('q', ''))
+    return JsonResponse({
+        'bouquets': [
+            {'id': bouquet.id, 'name': bouquet.name, 'price': bouquet.price, 'url': reverse('card', args=[bouquet.id])}
+            for bouquet in bouquets
+        ],
+        'html': render_to_string('catalog_bouquets.html', {'bouquets': bouquets}, request=request),
+    })
+
+
 def consultation(request: WSGIRequest) -> HttpResponse:
     context = {'form': ConsultationForm(class_name='singUpConsultation__form_input')}
 
@@ -132,18 +268,18 @@ def order(request: WSGIRequest, bouquet_id: int) -> HttpResponse:
         context['form'] = OrderForm(request.POST)
         if context['form'].is_valid():
             cleaned_inputs = context['form'].cleaned_data
-            delivery_window = DeliveryWindow.objects.get(id=int(cleaned_inputs['delivery_window']))
-
-            new_order = Order.objects.create(
+            # repeated submit of form with same key redirects to payment of order created by first submit
+            Order.objects.create_once(
+                cleaned_inputs['idempotency_key'] or uuid.uuid4(),
                 bouquet=selected_bouquet,
                 price=price_order,
                 client_name=cleaned_inputs['client_name'],
                 phone=cleaned_inputs['phone'],
                 delivery_address=cleaned_inputs['delivery_address'],
-                delivery_window=delivery_window,
+                # window is validated by choices of form, so it is not loaded
+                delivery_window_id=int(cleaned_inputs['delivery_window']),
                 paid=True
             )
-            new_order.save()
 
             response = redirect(link_order)
             return response
@@ -197,48 +333,170 @@ def result(request: WSGIRequest) -> HttpResponse:
     price_from = request.GET.get('price_from', None)
     price_to = request.GET.get('price_to', None)
 
-    context = {'bouquet': Bouquet.objects.get_recommended_bouquet(event, price_from, price_to)}
+    recommendations_count = 4
+
+    recommended_bouquets = get_recommendation_index().recommend(event, price_from, price_to, recommendations_count)
+    context = {
+        'bouquet': recommended_bouquets[0] if recommended_bouquets else None,
+        'other_bouquets': recommended_bouquets[1:],
+    }
     return render(request, 'result.html', context)
 
 
-@login_required
-def stats(request: WSGIRequest) -> HttpResponse:
-    period = request.GET.get('period', 'all')
-    bouquet = request.GET.get('bouquet', 'any')
+def get_dashboard_stats(period: str, bouquet: str) -> dict[str, Any]:
+    """Compute stats of dashboard for period and bouquet (id or "any")
+
+    Result contains only picklable values, so it can be cached.
+    """
     orders = Order.objects.exclude(status=Order.Status.cancelled)
+    # rollups contain only not cancelled orders
+    rollups = OrderRollup.objects.all()
     consultations = Consultation.objects.all()
     top_n = 5
 
     filter_params = {}
+    rollup_filter_params = {}
 
     if period in Order.DashboardFilterPeriod.names:
-        filter_params.update(**Order.dashboard_period_filters[period])
+        filter_params.update(**Order.get_dashboard_period_filters(period))
+        rollup_filter_params.update(**OrderRollup.get_dashboard_period_filters(period))
 
     # these stats should compute without bouquet filter
     consultations = consultations.filter(**filter_params)
     top_clients = orders.filter(**filter_params).get_top_n_clients(top_n)
-    top_bouquets = orders.filter(**filter_params).get_top_n_bouquets(top_n)
+    top_bouquets = rollups.filter(**rollup_filter_params).get_top_n_bouquets(top_n)
 
     if bouquet != 'any':
         try:
             int(bouquet)
             bouquet = Bouquet.objects.get(id=int(bouquet))
             filter_params['bouquet'] = bouquet
+            rollup_filter_params['bouquet'] = bouquet
         except (ValueError, Bouquet.DoesNotExist):
             pass
 
     orders = orders.filter(**filter_params)
+    rollups = rollups.filter(**rollup_filter_params)
+
+    summary = rollups.dashboard_summary()
+    durations_sketches, clients_sketch = OrderDailySketch.objects.filter(**rollup_filter_params).get_merged_sketches()
+    if settings.DASHBOARD_EXACT_UNIQUE_CLIENTS:
+        unique_clients_count = orders.values_list('phone', flat=True).distinct().count()
+    else:
+        unique_clients_count = clients_sketch.estimate()
+
+    return {
+        'orders_sum': summary['orders_sum'],
+        'orders_count': summary['orders_count'],
+        'unique_clients_count': unique_clients_count,
+        # standard error in percents
+        'unique_clients_count_error': (
+            None if settings.DASHBOARD_EXACT_UNIQUE_CLIENTS else round(ClientsSketch.STANDARD_ERROR * 100, 1)
+        ),
+        'consultations_count': consultations.count(),
+        'order_to_delivery_avg_time': TimedeltaWrapper(summary['order_to_delivery_avg_time']),
+        'order_to_compose_avg_time': TimedeltaWrapper(summary['order_to_compose_avg_time']),
+        'compose_to_delivery_avg_time': TimedeltaWrapper(summary['compose_to_delivery_avg_time']),
+        'most_popular_window': summary['most_popular_window'] or 'Не определено',
+        'by_hours_distribution': rollups.get_by_hours_distribution(),
+        'order_points_percentiles': [
+            {
+                'name': name,
+                **{
+                    f'p{percentile}': TimedeltaWrapper(durations_sketches[point].quantile(percentile / 100))
+                    for percentile in (50, 90, 99)
+                },
+            }
+            for point, name in ORDER_POINTS_NAMES.items()
+        ],
+        'order_points_histogram': [
+            {'name': name, 'counts': durations_sketches[point].histogram(ORDER_POINTS_HISTOGRAM_BOUNDS)}
+            for point, name in ORDER_POINTS_NAMES.items()
+        ],
+        'order_points_histogram_labels': ORDER_POINTS_HISTOGRAM_LABELS,
+        'top_bouquets': list(top_bouquets),
+        'top_clients': list(top_clients),
+    }
+
 
-    try:
-        most_popular_window = orders.select_related('delivery_window').values('delivery_window__name').annotate(
-            num=Count('delivery_window__name')
-        ).order_by('-num')[0]['delivery_window__name']
-    except IndexError:
-        most_popular_window = 'Не определено'
+def get_dashboard_params(request: WSGIRequest) -> tuple[str, str]:
+    """Get period and bouquet (id or "any") of dashboard from request
+
+    Params are normalized because they are parts of cache key.
+    """
+    period = request.GET.get('period', 'all')
+    bouquet = request.GET.get('bouquet', 'any')
+    if period not in Order.DashboardFilterPeriod.names:
+        period = 'all'
+    if not bouquet.isdigit():
+        bouquet = 'any'
+    return period, bouquet
+
+
+def get_dashboard_granularity(request: WSGIRequest, period: str) -> str:
+    """Get granularity of time series from request, default granularity depends on period"""
+    granularity = request.GET.get('granularity')
+    if granularity not in TIME_SERIES_GRANULARITIES_NAMES:
+        granularity = get_default_granularity(period)
+    return granularity
+
+
+def get_dashboard_time_series(period: str, bouquet: str, granularity: str) -> dict[str, Any]:
+    """Compute counts of orders in buckets of granularity for period and bouquet (id or "any") by rollups
+
+    Granularity can be coarsened if period is too long for it, result contains used granularity.
+    """
+    rollups = OrderRollup.objects.all()
+    if bouquet != 'any':
+        rollups = rollups.filter(bouquet_id=int(bouquet))
+    start, end = Order.get_dashboard_period_range(period)
+    if start:
+        rollups = rollups.filter(**OrderRollup.get_dashboard_period_filters(period))
+    # time series of current periods ends now, not at the end of day, month or year
+    end = min(end or timezone.now(), timezone.now())
+
+    granularity, time_series = rollups.get_time_series(granularity, start, end)
+    labels_format = TIME_SERIES_LABELS_FORMATS[granularity]
+    return {
+        'granularity': granularity,
+        'labels': [row['t'].strftime(labels_format) for row in time_series],
+        'counts': [row['num'] for row in time_series],
+    }
+
+
+def get_dashboard_heatmap(period: str, bouquet: str) -> list[list[int]]:
+    """Compute counts of orders by weekdays and hours for period and bouquet (id or "any") by rollups"""
+    rollups = OrderRollup.objects.all()
+    if period in Order.DashboardFilterPeriod.names:
+        rollups = rollups.filter(**OrderRollup.get_dashboard_period_filters(period))
+    if bouquet != 'any':
+        rollups = rollups.filter(bouquet_id=int(bouquet))
+    return rollups.get_weekday_hour_heatmap()
 
-    orders_dt_aggregated = orders.get_order_points_avg()
-    by_hours_distribution = orders.get_by_hours_distribution()
-    by_time_distribution = orders.get_by_time_distribution(period)
+
+@login_required
+def stats(request: WSGIRequest) -> HttpResponse:
+    period, bouquet = get_dashboard_params(request)
+
+    # dashboard version changes on every change of orders and consultations (see flowerapp.signals),
+    # periods are computed from current day
+    dashboard_stats = get_or_compute(
+        'dashboard',
+        [period, bouquet, timezone.localdate()],
+        lambda: get_dashboard_stats(period, bouquet)
+    )
+    heatmap = get_or_compute(
+        'dashboard',
+        ['heatmap', period, bouquet, timezone.localdate()],
+        lambda: get_dashboard_heatmap(period, bouquet)
+    )
+    heatmap_max = max(map(max, heatmap)) or 1
+    granularity = get_dashboard_granularity(request, period)
+    time_series = get_or_compute(
+        'dashboard',
+        ['time_series', period, bouquet, granularity, timezone.localdate()],
+        lambda: get_dashboard_time_series(period, bouquet, granularity)
+    )
 
     period_choices = [
         {'name': name, 'value': value}
@@ -247,19 +505,84 @@ def stats(request: WSGIRequest) -> HttpResponse:
     ]
 
     context = {
+        'period': period,
+        'bouquet': bouquet,
         'period_choices': period_choices,
         'bouquets': Bouquet.objects.all(),
-        'orders_sum': orders.aggregate(orders_sum=Sum('price'))['orders_sum'],
-        'orders_count': orders.count(),
-        'unique_clients_count': orders.values_list('phone', flat=True).distinct().count(),
-        'consultations_count': consultations.count(),
-        'order_to_delivery_avg_time': TimedeltaWrapper(orders_dt_aggregated['order_to_delivery_avg_time']),
-        'order_to_compose_avg_time': TimedeltaWrapper(orders_dt_aggregated['order_to_compose_avg_time']),
-        'compose_to_delivery_avg_time': TimedeltaWrapper(orders_dt_aggregated['compose_to_delivery_avg_time']),
-        'most_popular_window': most_popular_window,
-        'by_hours_distribution': by_hours_distribution,
-        'by_time_distribution': by_time_distribution,
-        'top_bouquets': top_bouquets,
-        'top_clients': top_clients
+        'export_models': EXPORT_MODELS_NAMES.items(),
+        'granularity_choices': TIME_SERIES_GRANULARITIES_NAMES.items(),
+        'time_series': time_series,
+        'heatmap_hours': range(24),
+        'heatmap': [
+            {
+                'weekday': weekday,
+                # opacity of cell shows how many orders are in this hour comparing with the busiest hour
+                'cells': [{'num': num, 'opacity': round(num / heatmap_max, 2)} for num in row],
+            }
+            for weekday, row in zip(WEEKDAYS_NAMES, heatmap)
+        ],
+        **dashboard_stats,
     }
     return render(request, 'stats.html', context)
+
+
+@login_required
+def stats_heatmap(request: WSGIRequest) -> JsonResponse:
+    """Counts of orders by weekdays (rows, from Monday) and hours (columns) for period and bouquet of dashboard"""
+    period, bouquet = get_dashboard_params(request)
+    heatmap = get_or_compute(
+        'dashboard',
+        ['heatmap', period, bouquet, timezone.localdate()],
+        lambda: get_dashboard_heatmap(period, bouquet)
+    )
+    return JsonResponse({
+        'period': period,
+        'bouquet': bouquet,
+        'weekdays': WEEKDAYS_NAMES,
+        'hours': list(range(24)),
+        'heatmap': heatmap,
+    })
+
+
+@login_required
+def stats_time_series(request: WSGIRequest) -> JsonResponse:
+    """Counts of orders in buckets of granularity (hour, day, week or month) for period and bouquet of dashboard"""
+    period, bouquet = get_dashboard_params(request)
+    granularity = get_dashboard_granularity(request, period)
+    time_series = get_or_compute(
+        'dashboard',
+        ['time_series', period, bouquet, granularity, timezone.localdate()],
+        lambda: get_dashboard_time_series(period, bouquet, granularity)
+    )
+    return JsonResponse({'period': period, 'bouquet': bouquet, **time_series})
+
+
+@user_passes_test(lambda user: user.is_staff, login_url='login')
+def stats_export(request: WSGIRequest, model_name: str) -> StreamingHttpResponse:
+    """Stream orders or consultations as CSV or JSON lines filtered by period and bouquet of dashboard
+
+    Consultations are filtered only by period, as on dashboard.
+    """
+    period, bouquet = get_dashboard_params(request)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+
+    filter_params = {}
+    if period in Order.DashboardFilterPeriod.names:
+        filter_params.update(**Order.get_dashboard_period_filters(period))
+
+    if model_name == 'orders':
+        if bouquet != 'any':
+            filter_params['bouquet_id'] = int(bouquet)
+        queryset, fields = Order.objects.filter(**filter_params), ORDER_EXPORT_FIELDS
+    elif model_name == 'consultations':
+        queryset, fields = Consultation.objects.filter(**filter_params), CONSULTATION_EXPORT_FIELDS
+    else:
+        raise Http404
+
+    content_type, iter_lines = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(iter_lines(iter_export_rows(queryset, fields), fields), content_type=content_type)
+    filename = f'{model_name}_{period}_{bouquet}_{timezone.localdate()}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response